@@ -20,14 +20,16 @@ def process_frames(dataset_config, bev_config, obj_det_config):
     end_frame = dataset_config.start_frame + dataset_config.n_frames
     frame_counter = 0
 
-    detection_performances_for_multi_confs = {}
-    # For precision recal plot
-    conf_thresholds = np.arange(0.1, 1.0, 0.1)
-    for conf in conf_thresholds:
-        detection_performances_for_multi_confs.setdefault(round(conf, 1), [])
+    # For precision recall plot, the detections have been matched once at the lowest threshold
+    conf_thresholds = np.round(np.arange(0.1, 1.0, 0.1), 1)
+    scores          = []
+    true_positives  = []
+    num_positives   = 0
+    record_thresh   = 0.0
+    inclusive       = True
 
-    precisions  = []
-    recalls     = []
+    # Detection performances stored separately for each threshold, used for frames without a match table
+    detection_performances_for_multi_confs = {conf: [] for conf in conf_thresholds}
 
     while True:
         try:
@@ -58,24 +60,47 @@ def process_frames(dataset_config, bev_config, obj_det_config):
             #                                   frame_counter)
             # lidar_bev_labels = utils.render_bb_over_bev(lidar_bev, frame.laser_labels, bev_config, True)
             
-            # Accumulate the detection performances from the file for different conf thresolds
-            for conf_thresh in conf_thresholds:
-                detection_performance = load_object_from_file(  obj_det_config.results_path, 
-                                                        dataset_config.tffile_name,
-                                                        obj_det_config.perf_obj_name + obj_det_config.model + "_" + f"{conf_thresh:.1f}",
-                                                        frame_counter)
-                detection_performances_for_multi_confs[round(conf_thresh, 1)].append(detection_performance)
+            # Accumulate the scored match table of the frame [scores, tp, num_positives, conf_thresh, conf_thresh_inclusive]
+            try:
+                frame_scores, frame_tp, frame_positives, frame_thresh, inclusive = load_object_from_file(obj_det_config.results_path, 
+                                                                                                         dataset_config.tffile_name,
+                                                                                                         obj_det_config.match_obj_name + obj_det_config.model,
+                                                                                                         frame_counter)
+                scores.append(frame_scores)
+                true_positives.append(frame_tp)
+                num_positives += frame_positives
+                record_thresh = max(record_thresh, frame_thresh)
+            except FileNotFoundError:
+                # Otherwise accumulate the detection performances from the file for different conf thresolds
+                for conf_thresh in conf_thresholds:
+                    detection_performance = load_object_from_file(  obj_det_config.results_path, 
+                                                            dataset_config.tffile_name,
+                                                            obj_det_config.perf_obj_name + obj_det_config.model + "_" + f"{conf_thresh:.1f}",
+                                                            frame_counter)
+                    detection_performances_for_multi_confs[conf_thresh].append(detection_performance)
             # Increment the frame counter
             frame_counter += 1
 
         except StopIteration:
             break
         
-    # Calculate the performance of the detection module
-    for conf, detection_performances in detection_performances_for_multi_confs.items():
-        precision, recall = utils.compute_precision_and_recall(detection_performances, obj_det_config.conf_thresh)
-        precisions.append(precision)
-        recalls.append(recall)
+    # Calculate the performance of the detection module for all thresholds at once
+    assert not (scores and detection_performances_for_multi_confs[conf_thresholds[0]]), \
+        "Frames with match tables and with detection performances can not be combined"
+    if scores:
+        precisions, recalls = utils.sweep_precision_and_recall(np.concatenate(scores),
+                                                               np.concatenate(true_positives),
+                                                               num_positives,
+                                                               conf_thresholds,
+                                                               record_thresh,
+                                                               inclusive)
+    else:
+        precisions  = []
+        recalls     = []
+        for conf, detection_performances in detection_performances_for_multi_confs.items():
+            precision, recall = utils.compute_precision_and_recall(detection_performances, conf)
+            precisions.append(precision)
+            recalls.append(recall)
 
     utils.plot_precision_recall(precisions, recalls)
 ################################################################
@@ -107,6 +132,7 @@ def process_data(config):
     obj_det_config.conf_thresh      = config['object_detection']['conf_thresh']
     obj_det_config.det_obj_name     = config['object_detection']['det_obj_name']
     obj_det_config.perf_obj_name    = config['object_detection']['perf_obj_name']
+    obj_det_config.match_obj_name   = config['object_detection']['match_obj_name']
 
     # Process all the frames within the given limit and 
     # Convert the 3d point cloud to BEV image
@@ -0,0 +1,61 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Export the object detection models into TorchScript and ONNX graphs
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+## general package imports
+import os
+import sys
+import argparse
+import torch
+
+## Add current working directory to path
+sys.path.append(os.getcwd())
+
+## 3d object detection
+import student.objdet_detect as det
+
+
+## Exports the pretrained model of each architecture and compares the exported graphs against the pytorch model,
+## if a graph deviates by more than tolerance, the exported files are removed and the export fails
+def export_and_verify(model_name, tolerance=1e-3):
+
+    configs = det.load_configs(model_name=model_name)
+    model = det.create_model(configs)
+    det.export_model(model, configs)
+
+    # all backends have to return the same outputs for a batch of bev maps
+    input_bev_maps = torch.rand((2, 3, configs.bev_height, configs.bev_width), device=configs.device)
+    with torch.no_grad():
+        reference = model(input_bev_maps)
+        for backend in ('torchscript', 'onnxruntime'):
+            configs.backend = backend
+            outputs = det.create_model(configs)(input_bev_maps)
+            if 'darknet' in configs.arch:
+                max_diff = (outputs - reference).abs().max().item()
+            else:
+                max_diff = max((outputs[head] - reference[head]).abs().max().item() for head in reference)
+            print('{} backend: max. deviation from pytorch outputs = {:.2e}'.format(backend, max_diff))
+            if max_diff > tolerance:
+                # the exported graphs must not be picked up by create_model
+                for filename in (configs.torchscript_filename, configs.onnx_filename):
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                raise AssertionError("Exported {} graph of '{}' deviates from pytorch model (max. deviation {:.2e})".format(
+                                     backend, model_name, max_diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export object detection models into TorchScript and ONNX graphs')
+    parser.add_argument('model_names', nargs='*', default=['darknet', 'fpn_resnet'], help="options are 'darknet', 'fpn_resnet'")
+    args = parser.parse_args()
+
+    for model_name in args.model_names:
+        export_and_verify(model_name)
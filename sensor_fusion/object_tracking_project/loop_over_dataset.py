@@ -37,6 +37,7 @@ import student.objdet_eval as eval
 
 import misc.objdet_tools as tools 
 from misc.helpers import save_object_to_file, load_object_from_file, make_exec_list
+from misc.prefetch import prefetch_frames
 
 ## Tracking
 from student.filter import Filter
@@ -44,6 +45,7 @@ from student.trackmanagement import Trackmanagement
 from student.association import Association
 from student.measurements import Sensor, Measurement
 from misc.evaluation import plot_tracks, plot_rmse, make_movie
+from misc.mot_metrics import TrackingMetrics
 import misc.params as params 
  
 ##################
@@ -54,12 +56,11 @@ data_filename = 'training_segment-1005081002024129653_5313_150_5333_150_with_cam
 # data_filename = 'training_segment-10072231702153043603_5725_000_5745_000_with_camera_labels.tfrecord' # Sequence 2
 # data_filename = 'training_segment-10963653239323173269_1924_000_1944_000_with_camera_labels.tfrecord' # Sequence 3
 show_only_frames = [0, 200] # show only frames in interval for debugging
+prefetch_depth = 4 # number of frames read and decoded ahead of the current one in worker processes (0 = no prefetching)
 
 ## Prepare Waymo Open Dataset file for loading
 data_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dataset', data_filename) # adjustable path in case this script is called from another working directory
 results_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
-datafile = WaymoDataFileReader(data_fullpath)
-datafile_iter = iter(datafile)  # initialize dataset iterator
 
 ## Initialize object detection
 configs_det = det.load_configs(model_name='fpn_resnet') # options are 'darknet', 'fpn_resnet'
@@ -70,6 +71,9 @@ configs_det.use_labels_as_objects = False # True = use groundtruth labels as obj
 ## Uncomment this setting to restrict the y-range in the final project
 configs_det.lim_y = [-25, 25] 
 
+## Initialize birds-eye view rasterizer, its output tensor is reused for all frames
+bev_rasterizer = pcl.BevRasterizer(configs_det)
+
 ## Initialize tracking
 KF = Filter() # set up Kalman filter 
 association = Association() # init data association
@@ -79,19 +83,54 @@ camera = None # init camera sensor object
 np.random.seed(10) # make random values predictable
 
 ## Selective execution and visualization
-exec_detection = []#'bev_from_pcl', 'detect_objects', 'validate_object_labels', 'measure_detection_performance'] #'bev_from_pcl', 'detect_objects', 'validate_object_labels', 'measure_detection_performance'] # options are 'bev_from_pcl', 'detect_objects', 'validate_object_labels', 'measure_detection_performance'; options not in the list will be loaded from file
-exec_tracking = ['perform_tracking'] # options are 'perform_tracking'
+exec_detection = []#'bev_from_pcl', 'detect_objects', 'validate_object_labels', 'measure_detection_performance'] #'bev_from_pcl', 'detect_objects', 'validate_object_labels', 'measure_detection_performance'] # options are 'bev_from_pcl', 'detect_objects', 'precompute_detections', 'validate_object_labels', 'measure_detection_performance', 'save_detection_matches'; options not in the list will be loaded from file
+exec_tracking = ['perform_tracking'] # options are 'perform_tracking', 'evaluate_tracking'
 exec_visualization = ['show_tracks', 'make_tracking_movie'] # options are 'show_range_image', 'show_bev', 'show_pcl', 'show_labels_in_image', 'show_objects_and_labels_in_bev', 'show_objects_in_bev_labels_in_camera', 'show_tracks', 'show_detection_performance', 'make_tracking_movie'
 exec_list = make_exec_list(exec_detection, exec_tracking, exec_visualization)
+match_conf_thresh = 0.1 # lowest threshold of the precision-recall sweep in bev_object_detection, detection matches are recorded with it
 vis_pause_time = 0 # set pause time between frames in ms (0 = stop between frames until key is pressed)
 
+## Only decode the parts of each frame which are used below
+frame_fields = {'context': None, 'timestamp_micros': None, 'pose': None, 'laser_labels': None,
+                'camera_labels': [dataset_pb2.CameraName.FRONT]}
+if any(i in exec_list for i in ('pcl_from_rangeimage', 'show_range_image')):
+    frame_fields['lasers'] = {'name': [dataset_pb2.LaserName.TOP], 'ri_return1': None}
+if 'load_image' in exec_list:
+    frame_fields['images'] = [dataset_pb2.CameraName.FRONT]
+pcl_lidar_name = dataset_pb2.LaserName.TOP if 'pcl_from_rangeimage' in exec_list else None # point-clouds are computed by the prefetcher
+
+## Recorded detection matches have to contain the detections of all thresholds of the sweep, so the detector runs with the
+## lowest one, which applies to all other results of this run as well
+if 'save_detection_matches' in exec_list:
+    configs_det.conf_thresh = match_conf_thresh
+
+## Detect objects in all selected frames in batches of configs_det.batch_size and store them in result files,
+## which are then loaded in the loop below (use instead of 'detect_objects' when processing complete segments)
+if 'precompute_detections' in exec_list:
+    detections_name = 'detections' if 'perform_tracking' in exec_list else 'detections_' + configs_det.arch + '_' + str(configs_det.conf_thresh)
+    with WaymoDataFileReader(data_fullpath) as datafile:
+        frame_ids = range(show_only_frames[0], min(show_only_frames[1] + 1, len(datafile)))
+    if 'pcl_from_rangeimage' in exec_list:
+        pcl_fields = {'context': None, 'pose': None, 'lasers': frame_fields['lasers']}
+        lidar_pcls = (lidar_pcl for _, lidar_pcl in prefetch_frames(data_fullpath, frame_ids.start, frame_ids.stop, pcl_fields, pcl_lidar_name, prefetch_depth, dtype=configs_det.precision))
+    else:
+        lidar_pcls = (load_object_from_file(results_fullpath, data_filename, 'lidar_pcl', frame_id) for frame_id in frame_ids)
+
+    for frame_id, detections in zip(frame_ids, det.detect_objects_in_batches(lidar_pcls, bev_rasterizer, model_det, configs_det)):
+        print('precomputed detections for frame #' + str(frame_id))
+        save_object_to_file(detections, results_fullpath, data_filename, detections_name, frame_id)
+
+datafile_iter = prefetch_frames(data_fullpath, show_only_frames[0], show_only_frames[1] + 1, frame_fields, pcl_lidar_name, prefetch_depth, dtype=configs_det.precision)  # initialize dataset iterator, seeking directly to the first selected frame
+
 
 ##################
 ## Perform detection & tracking over all selected frames
 
-cnt_frame = 0 
+cnt_frame = show_only_frames[0] 
 all_labels = []
+tracking_metrics = TrackingMetrics() # MOTA, MOTP, IDF1 and RMSE of the confirmed tracks
 det_performance_all = [] 
+det_metrics = eval.DetectionMetrics(configs_det.min_iou) # AP and statistics of all frames with scored detections
 np.random.seed(0) # make random values predictable
 if 'show_tracks' in exec_list:    
     fig, (ax2, ax) = plt.subplots(1,2) # init track plot
@@ -99,13 +138,7 @@ if 'show_tracks' in exec_list:
 while True:
     try:
         ## Get next frame from Waymo dataset
-        frame = next(datafile_iter)
-        if cnt_frame < show_only_frames[0]:
-            cnt_frame = cnt_frame + 1
-            continue
-        elif cnt_frame > show_only_frames[1]:
-            print('reached end of selected frames')
-            break
+        frame, prefetched_pcl = next(datafile_iter)
         
         print('------------------------------')
         print('processing frame #' + str(cnt_frame))
@@ -124,7 +157,7 @@ while True:
         ## Compute lidar point-cloud from range image    
         if 'pcl_from_rangeimage' in exec_list:
             print('computing point-cloud from lidar range image')
-            lidar_pcl = tools.pcl_from_range_image(frame, lidar_name)
+            lidar_pcl = prefetched_pcl
         else:
             print('loading lidar point-cloud from result file')
             lidar_pcl = load_object_from_file(results_fullpath, data_filename, 'lidar_pcl', cnt_frame)
@@ -132,19 +165,20 @@ while True:
         ## Compute lidar birds-eye view (bev)
         if 'bev_from_pcl' in exec_list:
             print('computing birds-eye view from lidar pointcloud')
-            lidar_bev = pcl.bev_from_pcl(lidar_pcl, configs_det)
+            lidar_bev = bev_rasterizer(lidar_pcl)
         else:
             print('loading birds-eve view from result file')
             lidar_bev = load_object_from_file(results_fullpath, data_filename, 'lidar_bev', cnt_frame)
 
-        ## 3D object detection
+        ## 3D object detection, the confidence scores are only known for objects detected in this run
+        scores = None
         if (configs_det.use_labels_as_objects==True):
             print('using groundtruth labels as objects')
             detections = tools.convert_labels_into_objects(frame.laser_labels, configs_det)
         else:
             if 'detect_objects' in exec_list:
                 print('detecting objects in lidar pointcloud')   
-                detections = det.detect_objects(lidar_bev, model_det, configs_det)
+                detections, scores = det.detect_objects_array(lidar_bev, model_det, configs_det, return_scores=True)
             else:
                 print('loading detected objects from result file')
                 # load different data for final project vs. mid-term project
@@ -174,6 +208,14 @@ while True:
                 det_performance = load_object_from_file(results_fullpath, data_filename, 'det_performance_' + configs_det.arch + '_' + str(configs_det.conf_thresh), cnt_frame)   
 
         det_performance_all.append(det_performance) # store all evaluation results in a list for performance assessment at the end
+        if scores is not None:
+            det_matches = det_metrics.update(detections, scores, frame.laser_labels, valid_label_flags)
+            if 'save_detection_matches' in exec_list:
+                # scored match table from which precision and recall of all confidence thresholds above configs_det.conf_thresh
+                # can be derived, e.g. by the precision-recall sweep of bev_object_detection; the threshold and the comparison
+                # of the detector with it are stored with the table
+                det_matches += [configs_det.conf_thresh, configs_det.conf_thresh_inclusive]
+                save_object_to_file(det_matches, results_fullpath, data_filename, 'det_matches_' + configs_det.arch, cnt_frame)
         
 
         ## Visualization for object detection
@@ -232,10 +274,9 @@ while True:
                     z[1] = z[1] + np.random.normal(0, params.sigma_cam_j)
                     meas_list_cam = camera.generate_measurement(cnt_frame, z, meas_list_cam)
             
-            # Kalman prediction
+            # Kalman prediction of all tracks at once
+            KF.predict_all(manager.table)
             for track in manager.track_list:
-                print('predict track', track.id)
-                KF.predict(track)
                 track.set_t((cnt_frame - 1)*0.1) # save next timestamp
                 
             # associate all lidar measurements to all tracks
@@ -251,6 +292,8 @@ while True:
             manager.result_list.append(copy.deepcopy(result_dict))
             label_list = [frame.laser_labels, valid_label_flags]
             all_labels.append(label_list)
+            if 'evaluate_tracking' in exec_list:
+                tracking_metrics.update_from_tracks(manager.track_list, frame.laser_labels, valid_label_flags, configs_det)
             
             # visualization
             if 'show_tracks' in exec_list:
@@ -278,6 +321,16 @@ while True:
 ## Evaluate object detection performance
 if 'show_detection_performance' in exec_list:
     eval.compute_performance_stats(det_performance_all)
+    if det_metrics.num_frames > 0:
+        print('mAP = ' + str(det_metrics.report()['mAP']))
+        det_metrics.plot()
+
+## Store tracking metrics, e.g. to compare different parameter sets
+if 'evaluate_tracking' in exec_list:
+    tracking_report = tracking_metrics.report()
+    print('MOTA = {:.4f}, MOTP = {:.4f} m, IDF1 = {:.4f}, id switches = {}'.format(
+          tracking_report['mota'], tracking_report['motp'], tracking_report['idf1'], tracking_report['num_switches']))
+    tracking_metrics.save_report(os.path.join(results_fullpath, os.path.splitext(data_filename)[0] + '__tracking_metrics.json'))
 
 ## Plot RMSE for all tracks
 if 'show_tracks' in exec_list:
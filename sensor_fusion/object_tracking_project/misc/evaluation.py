@@ -171,51 +171,37 @@ def plot_tracks(fig, ax, ax2, track_list, meas_list, lidar_labels, lidar_labels_
 
 
 def plot_rmse(manager, all_labels, configs_det):
+    # error of each confirmed track with respect to its closest valid label inside the detection area
+    track_errors = {} # track id --> (times, errors)
+    for result_dict, (labels, labels_valid) in zip(manager.result_list, all_labels):
+        track_ids = [track_id for track_id, track in result_dict.items() if track.state == 'confirmed']
+        label_positions = np.array([[label.box.center_x, label.box.center_y, label.box.center_z]
+                                    for label, valid in zip(labels, labels_valid) if valid], dtype=np.float64).reshape(-1, 3)
+        in_range = (label_positions[:, 0] > configs_det.lim_x[0]) & (label_positions[:, 0] < configs_det.lim_x[1]) & \
+                   (label_positions[:, 1] > configs_det.lim_y[0]) & (label_positions[:, 1] < configs_det.lim_y[1])
+        label_positions = label_positions[in_range]
+        if len(track_ids) == 0 or len(label_positions) == 0:
+            continue
+
+        # distances between all tracks and labels of this timestep, each track is compared to its closest label
+        track_positions = np.array([np.asarray(result_dict[track_id].x[0:3], dtype=np.float64).ravel() for track_id in track_ids])
+        dists = np.sqrt(((track_positions[:, None] - label_positions[None]) ** 2).sum(axis=2))
+        closest = dists.argmin(axis=1)
+        for track_id, error in zip(track_ids, dists[np.arange(len(track_ids)), closest]):
+            times, errors = track_errors.setdefault(track_id, ([], []))
+            times.append(result_dict[track_id].t)
+            errors.append(error)
+
     fig, ax = plt.subplots()
     plot_empty = True
     
-    # loop over all tracks
-    for track_id in range(manager.last_id+1):
-        rmse_sum = 0
-        cnt = 0
-        rmse = []
-        time = []
-        
-        # loop over timesteps
-        for i, result_dict in enumerate(manager.result_list):
-            label_list = all_labels[i]
-            if track_id not in result_dict:
-                continue
-            track = result_dict[track_id]
-            if track.state != 'confirmed':
-                continue
-            
-            # find closest label and calculate error at this timestamp
-            min_error = np.inf
-            for label, valid in zip(label_list[0], label_list[1]):
-                error = 0
-                if valid: 
-                    # check if label lies inside specified range
-                    if label.box.center_x > configs_det.lim_x[0] and label.box.center_x < configs_det.lim_x[1] and label.box.center_y > configs_det.lim_y[0] and label.box.center_y < configs_det.lim_y[1]:
-                        error += (label.box.center_x - float(track.x[0]))**2
-                        error += (label.box.center_y - float(track.x[1]))**2
-                        error += (label.box.center_z - float(track.x[2]))**2
-                        if error < min_error:
-                            min_error = error
-            if min_error < np.inf:
-                error = np.sqrt(min_error)
-                time.append(track.t)
-                rmse.append(error)     
-                rmse_sum += error
-                cnt += 1
-            
-        # calc overall RMSE
-        if cnt != 0:
-            plot_empty = False
-            rmse_sum /= cnt
-            # plot RMSE
-            ax.plot(time, rmse, marker='x', label='RMSE track ' + str(track_id) + '\n(mean: ' 
-                    + '{:.2f}'.format(rmse_sum) + ')')
+    # plot the error of each track over time
+    for track_id in sorted(track_errors):
+        times, errors = track_errors[track_id]
+        plot_empty = False
+        # plot RMSE
+        ax.plot(times, errors, marker='x', label='RMSE track ' + str(track_id) + '\n(mean: ' 
+                + '{:.2f}'.format(np.mean(errors)) + ')')
     
     # maximize window     
     mng = plt.get_current_fig_manager()
@@ -0,0 +1,173 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Multi-object tracking metrics (MOTA, MOTP, IDF1, RMSE)
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import json
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+# accumulate tracking performance frame by frame
+class TrackingMetrics:
+    """ CLEAR MOT metrics (MOTA, MOTP, id switches, fragmentations), identity metrics (IDF1, IDP, IDR) and the
+    RMSE of the tracked positions, accumulated in a single pass over a sequence.
+
+    In each frame, tracks and ground truth objects are matched by their euclidean center distance, pairs further
+    apart than max_dist can not be matched. Matches of the previous frame are kept as long as they are still valid,
+    all other objects are assigned with the Hungarian method.
+    """
+
+    def __init__(self, max_dist=2.0):
+        self.max_dist = max_dist
+
+        self.num_frames = 0
+        self.num_gt = 0 # no. of ground truth objects over all frames
+        self.num_tracks = 0 # no. of track positions over all frames
+        self.num_matches = 0
+        self.num_false_positives = 0
+        self.num_misses = 0
+        self.num_switches = 0
+        self.num_fragmentations = 0
+        self.sum_dist = 0.0
+        self.sum_sq_dist = 0.0
+
+        self.gt_index = {} # ground truth id --> index
+        self.last_match = {} # ground truth index --> track id of its last match
+        self.tracked = {} # ground truth index --> whether it has been matched when it was last present
+        self.track_holder = {} # track id --> ground truth index of its last match
+
+        # matched pairs (gt index, track id, time, distance) and gated pairs (gt index, track id) of all frames
+        self.matches = []
+        self.gated_pairs = []
+
+    def update(self, gt_ids, gt_positions, track_ids, track_positions, t=None):
+        """ Add a frame with the ids and (M, 3) positions of the ground truth objects and the ids and (N, 3)
+        positions of the tracks. t is the time of the frame or the (N,) times of the tracks and only used for the
+        match table. Returns the matched ground truth and track indices of the frame.
+        """
+        gt_idx = np.array([self.gt_index.setdefault(gt_id, len(self.gt_index)) for gt_id in gt_ids], dtype=np.int64)
+        track_ids = np.asarray(track_ids, dtype=np.int64).reshape(-1)
+        gt_positions = np.asarray(gt_positions, dtype=np.float64).reshape(-1, 3)
+        track_positions = np.asarray(track_positions, dtype=np.float64).reshape(-1, 3)
+        self.num_frames += 1
+
+        # distances between all ground truth objects and tracks
+        dists = np.sqrt(((gt_positions[:, None] - track_positions[None]) ** 2).sum(axis=2))
+        gated = dists < self.max_dist
+        rows, cols = np.nonzero(gated)
+        self.gated_pairs.append(np.column_stack((gt_idx[rows], track_ids[cols])))
+
+        # keep the matches of the previous frame which are still valid
+        track_col = {track_id: col for col, track_id in enumerate(track_ids)}
+        prev_cols = np.array([track_col.get(self.last_match.get(idx, -1), -1) if self.tracked.get(idx, False) else -1 for idx in gt_idx], dtype=np.int64)
+        keep = prev_cols >= 0
+        keep[keep] = gated[keep, prev_cols[keep]]
+        kept_rows, kept_cols = np.flatnonzero(keep), prev_cols[keep]
+        # a track is kept for at most one ground truth object, the closest one
+        order = np.lexsort((dists[kept_rows, kept_cols], kept_cols))
+        _, first = np.unique(kept_cols[order], return_index=True)
+        kept_rows, kept_cols = kept_rows[order[first]], kept_cols[order[first]]
+
+        # assign all other ground truth objects and tracks, pairs outside of the gate have a prohibitive cost
+        free_rows = np.setdiff1d(np.arange(len(gt_idx)), kept_rows)
+        free_cols = np.setdiff1d(np.arange(len(track_ids)), kept_cols)
+        cost = np.where(gated[np.ix_(free_rows, free_cols)], dists[np.ix_(free_rows, free_cols)], 1e9)
+        new_rows, new_cols = linear_sum_assignment(cost)
+        valid = cost[new_rows, new_cols] < 1e9
+        rows = np.concatenate((kept_rows, free_rows[new_rows[valid]]))
+        cols = np.concatenate((kept_cols, free_cols[new_cols[valid]]))
+
+        # id switches and fragmentations of the matched ground truth objects
+        for idx, track_id in zip(gt_idx[rows], track_ids[cols]):
+            last_match = self.last_match.get(idx)
+            if last_match is not None and last_match != track_id:
+                self.num_switches += 1
+            if last_match is not None and not self.tracked[idx]:
+                self.num_fragmentations += 1
+            self.last_match[idx] = track_id
+            # the ground truth object which held the track before can not keep it anymore
+            holder = self.track_holder.get(track_id)
+            if holder is not None and holder != idx and self.last_match.get(holder) == track_id:
+                self.tracked[holder] = False
+            self.track_holder[track_id] = idx
+        is_matched = np.zeros(len(gt_idx), dtype=bool)
+        is_matched[rows] = True
+        self.tracked.update(zip(gt_idx.tolist(), is_matched.tolist()))
+
+        matched_dists = dists[rows, cols]
+        self.num_gt += len(gt_idx)
+        self.num_tracks += len(track_ids)
+        self.num_matches += len(rows)
+        self.num_false_positives += len(track_ids) - len(rows)
+        self.num_misses += len(gt_idx) - len(rows)
+        self.sum_dist += matched_dists.sum()
+        self.sum_sq_dist += (matched_dists ** 2).sum()
+        times = np.broadcast_to(np.asarray(np.nan if t is None else t, dtype=np.float64), track_ids.shape)
+        self.matches.append(np.column_stack((gt_idx[rows], track_ids[cols], times[cols], matched_dists)))
+
+        return rows, cols
+
+    def update_from_tracks(self, track_list, labels, labels_valid, configs, t=None):
+        """ Add a frame with the confirmed tracks of track_list and the valid labels inside the detection area,
+        by default the times of the tracks are used """
+        tracks = [track for track in track_list if track.state == 'confirmed']
+        labels = [label for label, valid in zip(labels, labels_valid) if valid and
+                  configs.lim_x[0] < label.box.center_x < configs.lim_x[1] and configs.lim_y[0] < label.box.center_y < configs.lim_y[1]]
+        return self.update([label.id for label in labels],
+                           [[label.box.center_x, label.box.center_y, label.box.center_z] for label in labels],
+                           [track.id for track in tracks],
+                           [np.asarray(track.x[0:3], dtype=np.float64).ravel() for track in tracks],
+                           [track.t for track in tracks] if t is None else t)
+
+    def match_table(self):
+        # (gt index, track id, time, distance) of all matches
+        return np.concatenate(self.matches) if self.matches else np.zeros((0, 4))
+
+    def identity_matches(self):
+        # no. of frames of the optimal one-to-one assignment of ground truth trajectories to track trajectories
+        pairs = np.concatenate(self.gated_pairs) if self.gated_pairs else np.zeros((0, 2), dtype=np.int64)
+        if len(pairs) == 0:
+            return 0
+        gt_idx, gt_col = np.unique(pairs[:, 0], return_inverse=True)
+        track_ids, track_col = np.unique(pairs[:, 1], return_inverse=True)
+        counts = np.zeros((len(gt_idx), len(track_ids)), dtype=np.int64)
+        np.add.at(counts, (gt_col, track_col), 1)
+        rows, cols = linear_sum_assignment(counts, maximize=True)
+        return int(counts[rows, cols].sum())
+
+    def report(self):
+        """ Returns all results as a dictionary of plain python types, e.g. to be stored as json """
+        id_tp = self.identity_matches()
+        matches = self.match_table()
+        track_ids, track_rows = np.unique(matches[:, 1].astype(np.int64), return_inverse=True)
+        track_sq_dist = np.bincount(track_rows, weights=matches[:, 3] ** 2, minlength=len(track_ids))
+        track_count = np.bincount(track_rows, minlength=len(track_ids))
+
+        def _ratio(a, b, default=0.0):
+            return float(a / b) if b > 0 else default
+
+        return {'num_frames': self.num_frames, 'max_dist': self.max_dist,
+                'num_gt': self.num_gt, 'num_tracks': self.num_tracks, 'num_gt_ids': len(self.gt_index),
+                'num_matches': self.num_matches, 'num_false_positives': self.num_false_positives, 'num_misses': self.num_misses,
+                'num_switches': self.num_switches, 'num_fragmentations': self.num_fragmentations,
+                'mota': 1.0 - _ratio(self.num_misses + self.num_false_positives + self.num_switches, self.num_gt),
+                'motp': _ratio(self.sum_dist, self.num_matches),
+                'rmse': float(np.sqrt(_ratio(self.sum_sq_dist, self.num_matches))),
+                'idf1': _ratio(2 * id_tp, self.num_gt + self.num_tracks),
+                'idp': _ratio(id_tp, self.num_tracks),
+                'idr': _ratio(id_tp, self.num_gt),
+                'tracks': {int(track_id): {'rmse': float(np.sqrt(track_sq_dist[i] / track_count[i])), 'num_matches': int(track_count[i])}
+                           for i, track_id in enumerate(track_ids)}}
+
+    def save_report(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
@@ -17,6 +17,7 @@
 import cv2
 import numpy as np
 import math
+import functools
 from shapely.geometry import Polygon
 import zlib
 
@@ -48,41 +49,47 @@ def compute_beam_inclinations(calibration, height):
         return np.linspace(inclination_min, inclination_max, height)
 
 
-def compute_range_image_polar(range_image, extrinsic, inclination):
-    """ Convert a range image to polar coordinates. """
+@functools.lru_cache(maxsize=16)
+def _compute_range_image_directions(calibration_bytes, height, width, use_beam_inclinations, dtype):
+    calibration = dataset_pb2.LaserCalibration.FromString(calibration_bytes)
 
-    height = range_image.shape[0]
-    width = range_image.shape[1]
+    if use_beam_inclinations:
+        inclination = compute_beam_inclinations(calibration, height)
+    else:
+        inclination = np.linspace(calibration.beam_inclination_min, calibration.beam_inclination_max, height)
+    inclination = np.flip(inclination)
 
+    extrinsic = np.array(calibration.extrinsic.transform).reshape(4,4)
     az_correction = math.atan2(extrinsic[1,0], extrinsic[0,0])
     azimuth = np.linspace(np.pi,-np.pi,width) - az_correction
 
-    azimuth_tiled = np.broadcast_to(azimuth[np.newaxis,:], (height,width))
-    inclination_tiled = np.broadcast_to(inclination[:,np.newaxis],(height,width))
-
-    return np.stack((azimuth_tiled,inclination_tiled,range_image))
-
+    cos_incl = np.cos(inclination)[:,np.newaxis]
+    directions = np.stack(np.broadcast_arrays(np.cos(azimuth)[np.newaxis,:] * cos_incl,
+                                              np.sin(azimuth)[np.newaxis,:] * cos_incl,
+                                              np.sin(inclination)[:,np.newaxis]), axis=-1)
 
-def compute_range_image_cartesian(range_image_polar, extrinsic, pixel_pose, frame_pose):
-    """ Convert polar coordinates to cartesian coordinates. """
+    # rotate into vehicle space, the translation is added after scaling with the range
+    directions = (directions @ extrinsic[:3,:3].T).astype(dtype)
+    translation = extrinsic[:3,3].astype(dtype)
 
-    azimuth = range_image_polar[0]
-    inclination = range_image_polar[1]
-    range_image_range = range_image_polar[2]
+    # results are shared between all callers
+    directions.setflags(write=False)
+    translation.setflags(write=False)
+    return directions, translation
 
-    cos_azimuth = np.cos(azimuth)
-    sin_azimuth = np.sin(azimuth)
-    cos_incl = np.cos(inclination)
-    sin_incl = np.sin(inclination)
 
-    x = cos_azimuth * cos_incl * range_image_range
-    y = sin_azimuth * cos_incl * range_image_range
-    z = sin_incl * range_image_range
+def get_range_image_directions(calibration, height, width, use_beam_inclinations=True, dtype=np.float64):
+    """ Get the unit direction of each range image pixel in vehicle space and the lidar position.
 
-    range_image_points = np.stack([x,y,z,np.ones_like(z)])
-    range_image_points = np.einsum('ij,jkl->ikl', extrinsic,range_image_points)
+    A point in vehicle space is directions[row,col] * range + translation. The tables only depend on the
+    lidar calibration, so they are computed once per calibration and range image size and then cached.
+    use_beam_inclinations=False ignores calibration.beam_inclinations and always interpolates between
+    beam_inclination_min and beam_inclination_max. The tables are computed in double precision and then
+    stored as dtype.
+    """
 
-    return range_image_points
+    return _compute_range_image_directions(calibration.SerializeToString(), height, width, use_beam_inclinations,
+                                           np.dtype(dtype))
 
 
 def get_rotation_matrix(roll, pitch, yaw):
@@ -118,15 +125,9 @@ def get_rotation_matrix(roll, pitch, yaw):
     return pose
 
 
-def project_to_pointcloud(frame, ri, camera_projection, range_image_pose, calibration):
+def project_to_pointcloud(frame, ri, camera_projection, range_image_pose, calibration, dtype=np.float64):
     """ Create a pointcloud in vehicle space from LIDAR range image. """
-    beam_inclinations = compute_beam_inclinations(calibration, ri.shape[0])
-    beam_inclinations = np.flip(beam_inclinations)
-
-    extrinsic = np.array(calibration.extrinsic.transform).reshape(4,4)
-    frame_pose = np.array(frame.pose.transform).reshape(4,4)
-
-    ri_polar = compute_range_image_polar(ri[:,:,0], extrinsic, beam_inclinations)
+    directions, translation = get_range_image_directions(calibration, ri.shape[0], ri.shape[1], dtype=dtype)
 
     #    if range_image_pose is None:
     #        pixel_pose = None
@@ -137,12 +138,10 @@ def project_to_pointcloud(frame, ri, camera_projection, range_image_pose, calibr
     #            [pixel_pose, translation[:,:,:,np.newaxis]],
     #            [np.zeros_like(translation)[:,:,np.newaxis],np.ones_like(translation[:,:,0])[:,:,np.newaxis,np.newaxis]]])
 
-    ri_cartesian = compute_range_image_cartesian(ri_polar, extrinsic, None, frame_pose)
-    ri_cartesian = ri_cartesian.transpose(1,2,0)
-
     mask = ri[:,:,0] > 0
+    pcl = directions[mask] * ri[mask,0][:,np.newaxis].astype(dtype, copy=False) + translation
 
-    return ri_cartesian[mask,:3], ri[mask]
+    return pcl, ri[mask].astype(dtype, copy=False)
 
 
 def display_laser_on_image(img, pcl, vehicle_to_image):
@@ -176,7 +175,7 @@ def display_laser_on_image(img, pcl, vehicle_to_image):
         cv2.circle(img, (int(proj_pcl[i,0]),int(proj_pcl[i,1])), 1, coloured_intensity[i])
 
 # get lidar point cloud from frame
-def pcl_from_range_image(frame, lidar_name):
+def pcl_from_range_image(frame, lidar_name, dtype=np.float64):
 
     # extract lidar data and range image
     lidar = waymo_utils.get(frame.lasers, lidar_name)
@@ -184,7 +183,7 @@ def pcl_from_range_image(frame, lidar_name):
 
     # Convert the range image to a point cloud
     lidar_calib = waymo_utils.get(frame.context.laser_calibrations, lidar_name)
-    pcl, pcl_attr = project_to_pointcloud(frame, range_image, camera_projection, range_image_pose, lidar_calib)
+    pcl, pcl_attr = project_to_pointcloud(frame, range_image, camera_projection, range_image_pose, lidar_calib, dtype)
 
     # stack point cloud and lidar intensity
     points_all = np.column_stack((pcl, pcl_attr[:, 1]))
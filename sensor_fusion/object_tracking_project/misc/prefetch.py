@@ -0,0 +1,98 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Read and decode frames ahead of the main loop in worker processes
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import collections
+import multiprocessing
+import numpy as np
+
+# add project directory to python path to enable relative imports
+import os
+import sys
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+## Waymo open dataset reader
+from tools.waymo_reader.simple_waymo_open_dataset_reader import WaymoDataFileReader, dataset_pb2, parse_frame
+from tools.waymo_reader.simple_waymo_open_dataset_reader.wire_format import project_message
+
+# object detection tools and helper functions
+import misc.objdet_tools as tools
+
+# dataset reader of the current worker process, opened once by _init_worker
+_worker_reader = None
+
+
+def _init_worker(data_fullpath):
+    global _worker_reader
+    # all workers map the same file, so its pages are shared between processes
+    _worker_reader = WaymoDataFileReader(data_fullpath, use_mmap=True)
+
+
+def _load_frame(reader, index, fields, lidar_name, dtype):
+    # read and decode frame, then convert the range image into a point-cloud if requested
+    data = reader.read_record_buffer(index)
+    if fields is not None:
+        data = project_message(data, dataset_pb2.Frame.DESCRIPTOR, fields)
+    frame = parse_frame(data)
+
+    lidar_pcl = None
+    if lidar_name is not None:
+        lidar_pcl = tools.pcl_from_range_image(frame, lidar_name, dtype)
+    return data, frame, lidar_pcl
+
+
+def _load_frame_in_worker(index, fields, lidar_name, dtype):
+    # frames are sent back in serialized form, the (projected) record is much cheaper to transfer than to pickle
+    data, frame, lidar_pcl = _load_frame(_worker_reader, index, fields, lidar_name, dtype)
+    return bytes(data), lidar_pcl
+
+
+## Yields (frame, lidar_pcl) for all frames in range(start, stop), with up to depth frames prepared in advance
+def prefetch_frames(data_fullpath, start, stop, fields=None, lidar_name=None, depth=4, num_workers=None, dtype=np.float64):
+    """ Read, decode and (if lidar_name is given) convert frames to point-clouds in worker processes.
+
+    While the caller works on one frame, up to depth following frames are being prepared. Frames are always
+    returned in file order, so the caller sees the same sequence as with a sequential reader.
+    depth=0 reads all frames in the calling process, as do platforms without fork. dtype is the floating point type
+    of the point-clouds.
+    """
+
+    # the reader also builds the record index before the workers start, it is closed before they are forked
+    with WaymoDataFileReader(data_fullpath, use_mmap=True) as reader:
+        indices = range(*slice(start, stop).indices(len(reader)))
+
+        if depth <= 0 or 'fork' not in multiprocessing.get_all_start_methods():
+            for index in indices:
+                # the record itself is not kept, it is a view into the mapping which would prevent closing the reader
+                frame, lidar_pcl = _load_frame(reader, index, fields, lidar_name, dtype)[1:]
+                yield frame, lidar_pcl
+            return
+
+    if num_workers is None:
+        num_workers = min(depth, os.cpu_count() or 1)
+
+    # the workers are forked explicitly: with spawn or forkserver (the default on some platforms) each worker would
+    # re-import the calling script, which runs the complete loop at module level. Forking after torch has started its
+    # thread pools is safe here, because the workers only use numpy and protobuf
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes=num_workers, initializer=_init_worker, initargs=(data_fullpath,)) as pool:
+        pending = collections.deque()
+        for index in indices:
+            pending.append(pool.apply_async(_load_frame_in_worker, (index, fields, lidar_name, dtype)))
+            if len(pending) > depth:
+                data, lidar_pcl = pending.popleft().get()
+                yield parse_frame(data), lidar_pcl
+        while pending:
+            data, lidar_pcl = pending.popleft().get()
+            yield parse_frame(data), lidar_pcl
@@ -0,0 +1,106 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Quantize the fpn_resnet detection model and check its accuracy against the float model
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+## general package imports
+import os
+import sys
+import time
+import argparse
+import torch
+
+## Add current working directory to path
+sys.path.append(os.getcwd())
+
+## Waymo open dataset reader
+from misc.prefetch import prefetch_frames
+
+## 3d object detection
+import student.objdet_detect as det
+import student.objdet_eval as eval
+
+from misc.helpers import load_object_from_file
+
+
+## Loads the cached bev maps of the given frames into a single tensor
+def load_bev_maps(results_fullpath, data_filename, frame_ids):
+    return torch.cat([load_object_from_file(results_fullpath, data_filename, 'lidar_bev', frame_id) for frame_id in frame_ids])
+
+
+## Runs a model on the held-out frames and returns its precision, recall and inference time per frame
+def evaluate_model(model, bev_maps, labels, valid_label_flags, configs):
+
+    det_performance_all = []
+    inference_time = 0.0
+    for frame_bev_maps, frame_labels, frame_valid_label_flags in zip(bev_maps.split(1), labels, valid_label_flags):
+        start = time.perf_counter()
+        detections = det.detect_objects(frame_bev_maps, model, configs)
+        inference_time += time.perf_counter() - start
+        det_performance_all.append(eval.measure_detection_performance(detections, frame_labels, frame_valid_label_flags, configs.min_iou))
+
+    precision, recall = eval.compute_precision_recall([det_performance[2] for det_performance in det_performance_all])
+    return precision, recall, inference_time / len(bev_maps)
+
+
+## Calibrates the int8 model, compares it (and bf16 autocast) against the float model and saves it if it passes
+def quantize_and_verify(args):
+
+    # batch-norm layers are fused by the quantization itself
+    configs = det.load_configs(model_name='fpn_resnet')
+    configs.prepare_for_inference = False
+    float_model = det.create_model(configs)
+
+    results_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
+    calibration_bev_maps = load_bev_maps(results_fullpath, args.calibration_filename, range(*args.calibration_frames))
+    quantized_model = det.quantize_model(float_model, calibration_bev_maps, configs)
+    print('Calibrated int8 model on {} bev maps\n'.format(len(calibration_bev_maps)))
+
+    # accuracy gate on a sequence which has not been used for calibration
+    holdout_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dataset', args.holdout_filename)
+    frame_ids = range(*args.holdout_frames)
+    bev_maps = load_bev_maps(results_fullpath, args.holdout_filename, frame_ids)
+    labels = [frame.laser_labels for frame, _ in prefetch_frames(holdout_fullpath, frame_ids.start, frame_ids.stop, {'laser_labels': None}, depth=0)]
+    valid_label_flags = [load_object_from_file(results_fullpath, args.holdout_filename, 'valid_labels', frame_id) for frame_id in frame_ids]
+
+    results = {}
+    for quantization, model in ((None, float_model), ('int8', quantized_model), ('bf16', float_model)):
+        configs.quantization = quantization
+        results[quantization] = evaluate_model(model, bev_maps, labels, valid_label_flags, configs)
+
+    float_precision, float_recall, float_time = results[None]
+    for quantization, (precision, recall, inference_time) in results.items():
+        print('{}: precision = {:.4f}, recall = {:.4f}, {:.3f} s per frame ({:.1f}x)'.format(
+              quantization or 'float', precision, recall, inference_time, float_time / inference_time))
+
+    precision, recall, _ = results['int8']
+    assert recall >= float_recall - args.max_recall_drop, 'Recall of the int8 model dropped by {:.4f}'.format(float_recall - recall)
+    assert precision >= float_precision - args.max_precision_drop, 'Precision of the int8 model dropped by {:.4f}'.format(float_precision - precision)
+
+    # the traced model can be loaded without the model definition, see configs.quantization in objdet_detect.py
+    with torch.no_grad():
+        traced_model = torch.jit.trace(quantized_model, bev_maps[:1], strict=False, check_trace=False)
+    traced_model.save(configs.quantized_filename)
+    print('Saved int8 model to {}'.format(configs.quantized_filename))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantize the fpn_resnet model to int8, calibrated on cached lidar_bev frames')
+    parser.add_argument('--calibration_filename', default='training_segment-10072231702153043603_5725_000_5745_000_with_camera_labels.tfrecord',
+                        help='sequence whose cached lidar_bev frames are used for calibration')
+    parser.add_argument('--calibration_frames', nargs=2, type=int, default=[0, 50], metavar=('START', 'STOP'))
+    parser.add_argument('--holdout_filename', default='training_segment-1005081002024129653_5313_150_5333_150_with_camera_labels.tfrecord',
+                        help='sequence with cached lidar_bev frames and valid_labels used for the accuracy check')
+    parser.add_argument('--holdout_frames', nargs=2, type=int, default=[0, 200], metavar=('START', 'STOP'))
+    parser.add_argument('--max_recall_drop', type=float, default=0.01, help='max. allowed loss in recall compared to the float model')
+    parser.add_argument('--max_precision_drop', type=float, default=0.02, help='max. allowed loss in precision compared to the float model')
+    args = parser.parse_args()
+
+    quantize_and_verify(args)
@@ -26,25 +26,25 @@ class Filter:
     def __init__(self):
         pass
 
-    def F(self):
+    def F(self, dt=None):
         ############
         # TODO Step 1: implement and return system matrix F
         ############
         F = np.matrix(np.eye(6))
-        F[0, 3] = F[1, 4] = F[2, 5] = params.dt
+        F[0, 3] = F[1, 4] = F[2, 5] = params.dt if dt is None else dt
         return F
         
         ############
         # END student code
         ############ 
 
-    def Q(self):
+    def Q(self, dt=None):
         ############
         # TODO Step 1: implement and return process noise covariance Q
         ############
 
         q   = params.q
-        dt  = params.dt
+        dt  = params.dt if dt is None else dt
         q1  = ((dt**3)/3) *  q
         q2  = ((dt**2)/2) *  q
         q3  = dt * q
@@ -78,6 +78,14 @@ class Filter:
         # END student code
         ############ 
 
+    def predict_all(self, table, dt=None):
+        # predict the states and covariances of all tracks of a track table at once
+        F = np.asarray(self.F(dt))
+        Q = np.asarray(self.Q(dt))
+        n = len(table)
+        table.x[:n] = table.x[:n] @ F.T
+        table.P[:n] = F @ table.P[:n] @ F.T + Q
+
     def update(self, track, meas):
         ############
         # TODO Step 1: update state x and covariance P with associated measurement, save x and P in track
@@ -11,8 +11,12 @@
 #
 
 # general package imports
+import copy
+import hashlib
 import numpy as np
 import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 from easydict import EasyDict as edict
 
 # add project directory to python path to enable relative imports
@@ -24,7 +28,7 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 # model-related
 from tools.objdet_models.resnet.models import fpn_resnet
-from tools.objdet_models.resnet.utils.evaluation_utils import decode, post_processing 
+from tools.objdet_models.resnet.utils.evaluation_utils import decode_sparse, post_processing_array
 
 from tools.objdet_models.darknet.models.darknet2pytorch import Darknet as darknet
 from tools.objdet_models.darknet.utils.evaluation_utils import post_processing_v2
@@ -49,6 +53,7 @@ def load_configs_model(model_name='darknet', configs=None):
         configs.batch_size = 4
         configs.cfgfile = os.path.join(configs.model_path, 'config', 'complex_yolov4.cfg')
         configs.conf_thresh = 0.5
+        configs.conf_thresh_inclusive = True # objects with an object confidence >= conf_thresh are kept
         configs.distributed = False
         configs.img_size = 608
         configs.nms_thresh = 0.4
@@ -67,6 +72,7 @@ def load_configs_model(model_name='darknet', configs=None):
         configs.num_layers = 18
         configs.batch_size = 4
         configs.conf_thresh = 0.5
+        configs.conf_thresh_inclusive = False # objects with a heatmap peak > conf_thresh are kept
         configs.output_width = 608
         configs.num_samples = None
         configs.num_workers = 4
@@ -103,6 +109,27 @@ def load_configs_model(model_name='darknet', configs=None):
     configs.gpu_idx = 0  # GPU index to use.
     configs.device = torch.device('cpu' if configs.no_cuda else 'cuda:{}'.format(configs.gpu_idx))
 
+    # inference backend, options are 'torch', 'torchscript', 'onnxruntime' (cpu only)
+    # the torchscript and onnx graphs are created from the pretrained weights with export_detection_model.py
+    configs.backend = 'torch'
+    configs.torchscript_filename = os.path.splitext(configs.pretrained_filename)[0] + '.torchscript.pt'
+    configs.onnx_filename = os.path.splitext(configs.pretrained_filename)[0] + '.onnx'
+
+    # fold batch-norm layers into the convolutions ('torch') or freeze and optimize the graph ('torchscript'),
+    # the prepared model is verified against the original one when it is created
+    configs.prepare_for_inference = True
+
+    # cache of the weights of the created (and prepared) pytorch model, they are memory-mapped when loading, so that
+    # processes running the same model share their pages; an entry is only used if the cfg file, the checkpoint and
+    # the model source files are unchanged
+    configs.use_model_cache = True
+    configs.model_cache_path = os.path.join(configs.model_path, 'prepared')
+
+    # reduced precision inference on the cpu, options are None, 'int8' (fpn_resnet only) and 'bf16' (autocast)
+    # the int8 model is calibrated and checked against the float model with quantize_detection_model.py
+    configs.quantization = None
+    configs.quantized_filename = os.path.splitext(configs.pretrained_filename)[0] + '.int8.pt'
+
     return configs
 
 
@@ -121,6 +148,7 @@ def load_configs(model_name='fpn_resnet', configs=None):
     configs.bev_width = 608  # pixel resolution of bev image
     configs.bev_height = 608 
     configs.min_iou  = 0.5
+    configs.precision = 'float64' # floating point type of point-clouds and bev maps up to the model input, options are 'float64', 'float32'
     # add model-dependent parameters
     configs = load_configs_model(model_name, configs)
 
@@ -131,11 +159,147 @@ def load_configs(model_name='fpn_resnet', configs=None):
     return configs
 
 
-# create model according to selected model type
-def create_model(configs):
+# names of the model outputs, as used for the exported graphs
+def get_model_output_names(configs):
+    if 'darknet' in configs.arch:
+        return ['detections']
+    else:
+        return list(configs.heads)
+
+
+# runs an exported onnx graph with ONNX Runtime and returns the outputs in the same format as the pytorch model
+class OnnxRuntimeModel:
+    def __init__(self, onnx_filename, configs):
+        import onnxruntime
+
+        # let the runtime apply all graph optimizations, e.g. fusion of conv, batch-norm and activation layers
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_filename, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.single_output = 'darknet' in configs.arch
+
+    def __call__(self, input_bev_maps):
+        outputs = self.session.run(self.output_names, {self.input_name: input_bev_maps.cpu().numpy()})
+        outputs = [torch.from_numpy(output) for output in outputs]
+        if self.single_output:
+            return outputs[0]
+        return dict(zip(self.output_names, outputs))
+
+
+# fold all batch-norm layers which directly follow a convolution into the convolution weights (model in eval mode)
+def fold_batch_norms(model):
+
+    for module in list(model.modules()):
+        # sequential blocks (darknet layers, resnet downsampling) apply their children in order,
+        # the resnet blocks name their layers conv1 / bn1, conv2 / bn2, ...
+        if isinstance(module, nn.Sequential):
+            names = list(module._modules)
+            pairs = zip(names[:-1], names[1:])
+        else:
+            pairs = [('conv' + name[2:], name) for name in module._modules if name.startswith('bn')]
+
+        for conv_name, bn_name in pairs:
+            conv = module._modules.get(conv_name)
+            bn = module._modules.get(bn_name)
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                setattr(module, conv_name, fuse_conv_bn_eval(conv, bn))
+                setattr(module, bn_name, nn.Identity())
 
-    # check for availability of model file
-    assert os.path.isfile(configs.pretrained_filename), "No file at {}".format(configs.pretrained_filename)
+    return model
+
+
+# compare the outputs of a prepared model against the original model for a random bev map
+def verify_prepared_model(model, reference_model, configs, tolerance=1e-3):
+
+    input_bev_maps = torch.rand((1, 3, configs.bev_height, configs.bev_width), device=configs.device)
+    with torch.no_grad():
+        outputs = model(input_bev_maps)
+        reference = reference_model(input_bev_maps)
+
+    if not isinstance(reference, dict):
+        outputs, reference = {'output': outputs}, {'output': reference}
+    for name in reference:
+        max_diff = (outputs[name] - reference[name]).abs().max().item()
+        assert torch.allclose(outputs[name], reference[name], rtol=tolerance, atol=tolerance), \
+            "Prepared model deviates from original model in output '{}' (max. deviation {:.2e})".format(name, max_diff)
+
+
+# names of the fpn_resnet sub-modules which are quantized, the feature pyramid merging stays in float
+def get_quantizable_blocks(configs):
+    fpn_heads = ['fpn{}_{}'.format(fpn_idx, head) for fpn_idx in range(3) for head in sorted(configs.heads)]
+    return ['conv1', 'layer1', 'layer2', 'layer3', 'layer4', 'conv_up_level1', 'conv_up_level2', 'conv_up_level3'] + fpn_heads
+
+
+# post-training static int8 quantization of fpn_resnet, calibrated on a (N, 3, bev_height, bev_width) tensor of bev maps
+def quantize_model(model, calibration_bev_maps, configs):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    assert 'fpn_resnet' in configs.arch, 'Quantization is only supported for fpn_resnet'
+    model = copy.deepcopy(model).cpu().eval()
+
+    # the size-dependent control flow of the model cannot be traced, so each convolution block is traced and
+    # quantized on its own; the stem is merged into a single block to let conv, batch-norm and relu be fused
+    model.conv1 = nn.Sequential(model.conv1, model.bn1, model.relu, model.maxpool)
+    model.bn1, model.relu, model.maxpool = nn.Identity(), nn.Identity(), nn.Identity()
+    block_names = get_quantizable_blocks(configs)
+
+    # record an example input of every block
+    example_inputs = {}
+    hooks = [getattr(model, name).register_forward_pre_hook(lambda module, inputs, name=name: example_inputs.setdefault(name, inputs))
+             for name in block_names]
+    with torch.no_grad():
+        model(calibration_bev_maps[:1].cpu())
+    for hook in hooks:
+        hook.remove()
+
+    # insert observers, collect the activation ranges of all calibration bev maps and convert to int8 kernels
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    for name in block_names:
+        setattr(model, name, prepare_fx(getattr(model, name), qconfig_mapping, example_inputs[name]))
+    with torch.no_grad():
+        for bev_maps in calibration_bev_maps.split(configs.batch_size):
+            model(bev_maps.cpu())
+    for name in block_names:
+        setattr(model, name, convert_fx(getattr(model, name)))
+
+    return model
+
+
+# version of the cache file layout, entries written by an older layout are never loaded
+MODEL_CACHE_VERSION = 2
+
+
+# file name of the cached model, keyed by a hash of everything the created model depends on
+def get_model_cache_filename(configs):
+
+    key = hashlib.sha256()
+    key.update(repr([MODEL_CACHE_VERSION, configs.arch, configs.get('num_layers'), configs.get('heads'),
+                     configs.get('head_conv'), configs.get('use_giou_loss'), configs.prepare_for_inference,
+                     torch.__version__]).encode())
+    if configs.arch == 'darknet':
+        with open(configs.cfgfile, 'rb') as f:
+            key.update(f.read())
+
+    # the model definition and the preparation in this file determine which tensors the cached state dict holds
+    model_dir = os.path.join(configs.model_path, 'models')
+    source_filenames = [os.path.join(model_dir, name) for name in sorted(os.listdir(model_dir)) if name.endswith('.py')]
+    for filename in source_filenames + [os.path.realpath(__file__)]:
+        with open(filename, 'rb') as f:
+            key.update(f.read())
+
+    # the checkpoint is identified by its path, size and modification time instead of its contents,
+    # hashing hundreds of megabytes would take longer than loading the cached model
+    stat = os.stat(configs.pretrained_filename)
+    key.update(repr([os.path.abspath(configs.pretrained_filename), stat.st_size, stat.st_mtime_ns]).encode())
+
+    return os.path.join(configs.model_cache_path, '{}_{}.pt'.format(configs.arch, key.hexdigest()[:16]))
+
+
+# build the model architecture with its initial weights
+def build_model(configs):
 
     # create model depending on architecture name
     if (configs.arch == 'darknet') and (configs.cfgfile is not None):
@@ -156,40 +320,137 @@ def create_model(configs):
     else:
         assert False, 'Undefined model backbone'
 
+    return model
+
+
+# create model according to selected model type
+def create_model(configs):
+
+    # exported graphs do not need the model definition
+    configs.device = torch.device('cpu' if configs.no_cuda else 'cuda:{}'.format(configs.gpu_idx))
+    if configs.quantization == 'int8':
+        assert os.path.isfile(configs.quantized_filename), "No file at {}".format(configs.quantized_filename)
+        assert configs.device.type == 'cpu', "Quantized models only support cpu inference"
+        model = torch.jit.load(configs.quantized_filename, map_location=configs.device)
+        model.eval()
+        print('Loaded quantized model from {}\n'.format(configs.quantized_filename))
+        return model
+
+    elif configs.backend == 'torchscript':
+        assert os.path.isfile(configs.torchscript_filename), "No file at {}".format(configs.torchscript_filename)
+        model = torch.jit.load(configs.torchscript_filename, map_location=configs.device)
+        model.eval()
+        print('Loaded torchscript model from {}\n'.format(configs.torchscript_filename))
+
+        # freezing inlines all weights, which allows folding batch-norm layers and fusing activations into the convolutions
+        if configs.prepare_for_inference:
+            frozen_model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+            verify_prepared_model(frozen_model, model, configs)
+            model = frozen_model
+            print('Froze and optimized torchscript model for inference\n')
+        return model
+
+    elif configs.backend == 'onnxruntime':
+        assert os.path.isfile(configs.onnx_filename), "No file at {}".format(configs.onnx_filename)
+        assert configs.device.type == 'cpu', "The onnxruntime backend only supports cpu inference"
+        model = OnnxRuntimeModel(configs.onnx_filename, configs)
+        print('Loaded onnx model from {}\n'.format(configs.onnx_filename))
+        return model
+
+    elif configs.backend != 'torch':
+        assert False, 'Undefined inference backend'
+
+    # check for availability of model file
+    assert os.path.isfile(configs.pretrained_filename), "No file at {}".format(configs.pretrained_filename)
+
+    # only the weights of a prepared model are cached, the architecture is rebuilt from the current source
+    # and the cached tensors are mapped into it instead of being read into memory
+    model = build_model(configs)
+    if configs.use_model_cache:
+        cache_filename = get_model_cache_filename(configs)
+        if os.path.isfile(cache_filename):
+            model.eval()
+            if configs.prepare_for_inference:
+                model = fold_batch_norms(model)
+            state_dict = torch.load(cache_filename, map_location='cpu', mmap=True, weights_only=True)
+            model.load_state_dict(state_dict, assign=True)
+            model = model.to(device=configs.device)
+            print('Loaded cached model from {}\n'.format(cache_filename))
+            return model
+
     # load model weights
     model.load_state_dict(torch.load(configs.pretrained_filename, map_location='cpu'))
     print('Loaded weights from {}\n'.format(configs.pretrained_filename))
 
     # set model to evaluation state
-    configs.device = torch.device('cpu' if configs.no_cuda else 'cuda:{}'.format(configs.gpu_idx))
     model = model.to(device=configs.device)  # load model to either cpu or gpu
     model.eval()          
 
+    # remove the batch-norm layers, saving one pass over each of their feature maps
+    if configs.prepare_for_inference:
+        reference_model = copy.deepcopy(model)
+        model = fold_batch_norms(model)
+        verify_prepared_model(model, reference_model, configs)
+        print('Folded batch-norm layers into convolutions\n')
+
+    # write to a temporary file first, so that concurrent processes never load a partially written state dict
+    if configs.use_model_cache:
+        os.makedirs(configs.model_cache_path, exist_ok=True)
+        temp_filename = '{}.{}.tmp'.format(cache_filename, os.getpid())
+        torch.save(model.state_dict(), temp_filename)
+        os.replace(temp_filename, cache_filename)
+        print('Saved prepared model to {}\n'.format(cache_filename))
+
     return model
 
 
-# detect trained objects in birds-eye view
-def detect_objects(input_bev_maps, model, configs):
+# export a pytorch model into a torchscript and an onnx graph, to be used with the corresponding configs.backend
+def export_model(model, configs):
+
+    # the graphs are traced with a single bev map, the batch dimension is kept dynamic
+    input_bev_maps = torch.zeros((1, 3, configs.bev_height, configs.bev_width), device=configs.device)
+    output_names = get_model_output_names(configs)
+
+    with torch.no_grad():
+        # darknet modifies its attributes in forward, so the built-in re-trace check would always fail, the exported
+        # outputs are compared against the pytorch model in export_detection_model.py instead
+        traced_model = torch.jit.trace(model, input_bev_maps, strict=False, check_trace=False)
+        traced_model.save(configs.torchscript_filename)
+        print('Saved torchscript model to {}'.format(configs.torchscript_filename))
+
+        dynamic_axes = {name: {0: 'batch'} for name in ['bev_maps'] + output_names}
+        torch.onnx.export(model, input_bev_maps, configs.onnx_filename, input_names=['bev_maps'], output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=13, dynamo=False)
+        print('Saved onnx model to {}'.format(configs.onnx_filename))
+
+
+# detect trained objects in a batch of birds-eye view maps, returns an (N, 8) float32 array of objects
+# [cls, x, y, z, h, w, l, yaw] in vehicle coordinates for each bev map, with return_scores=True a tuple of these
+# objects and their (N,) float32 array of confidence scores, i.e. the values which are compared against configs.conf_thresh
+def detect_objects_batch_array(input_bev_maps, model, configs, return_scores=False):
     # deactivate autograd engine during test to reduce memory usage and speed up computations
     with torch.no_grad():  
 
-        # perform inference
-        outputs = model(input_bev_maps)
+        # perform inference on all bev maps in a single forward pass, the decoding always runs in float
+        with torch.autocast(configs.device.type, dtype=torch.bfloat16, enabled=(configs.quantization == 'bf16')):
+            outputs = model(input_bev_maps)
+        if configs.quantization == 'bf16':
+            outputs = outputs.float() if torch.is_tensor(outputs) else {name: output.float() for name, output in outputs.items()}
 
-        # decode model output into target object format
+        # decode model output into (N, 8) arrays of detections [score, x, y, z, h, w, l, yaw] in bev image coordinates
+        batch_detections = []
         if 'darknet' in configs.arch:
 
             # perform post-processing
             output_post = post_processing_v2(outputs, conf_thresh=configs.conf_thresh, nms_thresh=configs.nms_thresh) 
-            detections = []
-            for sample_i in range(len(output_post)):
-                if output_post[sample_i] is None:
-                    continue
-                detection = output_post[sample_i]
-                for obj in detection:
-                    x, y, w, l, im, re, _, _, _ = obj
-                    yaw = np.arctan2(im, re)
-                    detections.append([1, x, y, 0.0, 1.50, w, l, yaw])    
+            for detection in output_post:
+                detections = np.zeros((0, 8), dtype=np.float32)
+                if detection is not None:
+                    x, y, w, l, im, re, object_conf, class_score = detection[:, :8].numpy().T
+                    ones = np.ones_like(x)
+                    # the score is the object confidence, which post-processing compares against conf_thresh
+                    detections = np.column_stack((object_conf, x, y, 0.0 * ones, 1.50 * ones, w, l, np.arctan2(im, re)))
+                batch_detections.append(detections)
 
         elif 'fpn_resnet' in configs.arch:
             # decode output and perform post-processing
@@ -203,49 +464,101 @@ def detect_objects(input_bev_maps, model, configs):
             
             outputs['hm_cen']       = _sigmoid(outputs['hm_cen'])
             outputs['cen_offset']   = _sigmoid(outputs['cen_offset'])
-            # Detections size   (batch_size, K, 10)
-            outputs = decode(outputs['hm_cen'], outputs['cen_offset'], outputs['direction'], 
-                                outputs['z_coor'], outputs['dim'], K=configs.K)
+            # Detections size   (num_detections, 10) for each sample, only peaks above conf_thresh are decoded
+            outputs = decode_sparse(outputs['hm_cen'], outputs['cen_offset'], outputs['direction'], 
+                                    outputs['z_coor'], outputs['dim'], K=configs.K, conf_thresh=configs.conf_thresh)
             # Move the outputs from GPU (if device was GPU) to CPU and convert the type from torch.tensor to numpy array
-            outputs = outputs.numpy().astype(np.float32)
-            output_post = post_processing(outputs, configs)
-            output_post = output_post[0]
-            detections = []
-            for j in range(configs.num_classes):
-                if len(output_post[j]) > 0:
-                    for det in output_post[j]:
-                        score, x, y, z, h, w, l, yaw = det
-                        detections.append([1, x, y, z, h, w, l, yaw])
+            outputs = [output.cpu().numpy().astype(np.float32) for output in outputs]
+            output_post = post_processing_array(outputs, configs)
+            for sample_post in output_post:
+                # score, x, y, z, h, w, l, yaw
+                batch_detections.append(sample_post[:, :8])
 
             #######
             ####### ID_S3_EX1-5 END #######     
             
+    # score, x, y, z, h, w, l, yaw --> 1, x, y, z, h, w, l, yaw
+    batch_objects = []
+    for detections in batch_detections:
+        objects = convert_detections_into_object_array(detections, configs)
+        scores = objects[:, 0].copy()
+        objects[:, 0] = 1
+        batch_objects.append((objects, scores) if return_scores else objects)
+
+    return batch_objects
+
+
+# detect trained objects in a batch of birds-eye view maps, returns a list of objects for each bev map
+def detect_objects_batch(input_bev_maps, model, configs):
+    return [objects.tolist() for objects in detect_objects_batch_array(input_bev_maps, model, configs)]
+
+
+# detect trained objects in birds-eye view, returns an (N, 8) float32 array of objects [cls, x, y, z, h, w, l, yaw]
+# and with return_scores=True also the (N,) float32 array of their confidence scores
+def detect_objects_array(input_bev_maps, model, configs, return_scores=False):
+
+    # all bev maps are part of the same frame, so their objects are combined
+    batch_objects = detect_objects_batch_array(input_bev_maps, model, configs, return_scores=True)
+    objects = np.concatenate([objects for objects, _ in batch_objects])
+    if return_scores:
+        return objects, np.concatenate([scores for _, scores in batch_objects])
+    return objects
+
+
+# detect trained objects in birds-eye view
+def detect_objects(input_bev_maps, model, configs):
+
+    return detect_objects_array(input_bev_maps, model, configs).tolist()
+
+
+# detect objects in a sequence of point-clouds, running the model on batches of configs.batch_size bev maps
+def detect_objects_in_batches(lidar_pcls, bev_rasterizer, model, configs):
+
+    # the rasterizer reuses its output tensor, so each bev map is copied into the batch before the next one is created
+    batch_bev_maps = torch.zeros((configs.batch_size, 3, configs.bev_height, configs.bev_width), device=configs.device)
+    num_maps = 0
+    for lidar_pcl in lidar_pcls:
+        batch_bev_maps[num_maps] = bev_rasterizer(lidar_pcl)[0]
+        num_maps += 1
+        if num_maps == configs.batch_size:
+            yield from detect_objects_batch(batch_bev_maps, model, configs)
+            num_maps = 0
+
+    # last, partially filled batch
+    if num_maps > 0:
+        yield from detect_objects_batch(batch_bev_maps[:num_maps], model, configs)
+
+
+# convert detections in bev image coordinates into objects in vehicle coordinates
+def convert_detections_into_objects(detections, configs):
+    return convert_detections_into_object_array(detections, configs).tolist()
+
+
+# convert an (N, 8) array of detections [cls, x, y, z, h, w, l, yaw] in bev image coordinates into an (N, 8) float32
+# array of objects in vehicle coordinates, objects outside of the detection area are removed
+def convert_detections_into_object_array(detections, configs):
 
     ####### ID_S3_EX2 START #######     
     #######
     # Extract 3d bounding boxes from model response
     print("student task ID_S3_EX2")
-    objects = [] 
-
-    ## step 1 : check whether there are any detections
-    for det in detections:
-        ## step 2 : loop over all detections
-        cls, bev_x, bev_y, z, h, bev_w, bev_l, yaw = det
-        ## step 3 : perform the conversion using the limits for x, y and z set in the configs structure
-        
-        x   = bev_y / configs.bev_height * (configs.lim_x[1] - configs.lim_x[0])
-        y   = bev_x / configs.bev_width * (configs.lim_y[1] - configs.lim_y[0]) - (configs.lim_y[1] - configs.lim_y[0])/2.0
-        
-        w   = bev_w / configs.bev_width * (configs.lim_y[1] - configs.lim_y[0])
-        l   = bev_l / configs.bev_height * (configs.lim_x[1] - configs.lim_x[0])
-
-        ##  step 4 : append the current object to the 'objects' array
-        if ((x >= configs.lim_x[0]) & (x <= configs.lim_x[1]) &
-            (y >= configs.lim_y[0]) & (y <= configs.lim_y[1]) &
-            (z >= configs.lim_z[0]) & (z <= configs.lim_z[1])):
-                objects.append([1, x.item(), y.item(), z, h, w.item(), l.item(), yaw.item()])
+    detections = np.asarray(detections, dtype=np.float32).reshape(-1, 8)
+    objects = detections.copy()
+
+    ## step 1 : perform the conversion using the limits for x, y and z set in the configs structure
+    range_x = configs.lim_x[1] - configs.lim_x[0]
+    range_y = configs.lim_y[1] - configs.lim_y[0]
+    objects[:, 1] = detections[:, 2] / configs.bev_height * range_x
+    objects[:, 2] = detections[:, 1] / configs.bev_width * range_y - range_y / 2.0
+    objects[:, 5] = detections[:, 5] / configs.bev_width * range_y
+    objects[:, 6] = detections[:, 6] / configs.bev_height * range_x
+
+    ## step 2 : keep all objects inside the detection area
+    x, y, z = objects[:, 1], objects[:, 2], objects[:, 3]
+    inside = ((x >= configs.lim_x[0]) & (x <= configs.lim_x[1]) &
+              (y >= configs.lim_y[0]) & (y <= configs.lim_y[1]) &
+              (z >= configs.lim_z[0]) & (z <= configs.lim_z[1]))
     #######
     ####### ID_S3_EX2 START #######   
     
-    return objects    
-
+    return objects[inside]
@@ -17,8 +17,7 @@ import matplotlib
 import matplotlib.pyplot as plt
 
 import torch
-from shapely.geometry import Polygon
-from operator import itemgetter
+from scipy.optimize import linear_sum_assignment
 
 # add project directory to python path to enable relative imports
 import os
@@ -28,59 +27,81 @@ SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 # object detection tools and helper functions
-import misc.objdet_tools as tools
+from tools.objdet_models.darknet.utils.evaluation_utils import iou_rotated_boxes_matrix_cpu, ap_per_class
+
+
+# compute iou and center deviations between all labels and all detections at once
+def compute_iou_matrix(detections, labels):
+    """ Returns the (num_labels, num_detections) iou matrix and the (num_labels, num_detections, 3) matrix of
+    absolute center deviations in x, y and z. Detections are given as list or (N, 8) array of
+    [id, x, y, z, h, w, l, yaw] in vehicle coordinates.
+    """
+    detections = np.asarray(detections, dtype=np.float64).reshape(-1, 8)
+    label_boxes = np.array([[label.box.center_x, label.box.center_y, label.box.center_z,
+                             label.box.width, label.box.length, label.box.heading] for label in labels], dtype=np.float64).reshape(-1, 6)
+
+    # rotated boxes as (x, y, w, l, im, re)
+    ious = iou_rotated_boxes_matrix_cpu(
+        np.column_stack((label_boxes[:, [0, 1, 3, 4]], np.sin(label_boxes[:, 5]), np.cos(label_boxes[:, 5]))),
+        np.column_stack((detections[:, [1, 2, 5, 6]], np.sin(detections[:, 7]), np.cos(detections[:, 7]))))
+    center_devs = np.abs(label_boxes[:, None, :3] - detections[None, :, 1:4])
+
+    return ious, center_devs
+
+
+# assign each label at most one detection and vice versa, only pairs with iou >= min_iou can be matched
+def match_labels_and_detections(ious, min_iou=0.5, matching='greedy', scores=None):
+    """ Returns the label and detection indices of all matched pairs, sorted by label index. matching='greedy'
+    repeatedly takes the remaining pair with the highest iou, matching='hungarian' maximizes the sum of the ious.
+    matching='score' lets the detections pick their label in the order of their scores, as needed for average precision.
+    """
+    candidates = ious >= min_iou
+    if matching == 'hungarian':
+        label_idx, det_idx = linear_sum_assignment(np.where(candidates, ious, 0.0), maximize=True)
+        matched = candidates[label_idx, det_idx]
+        return label_idx[matched], det_idx[matched]
+
+    assert matching in ('greedy', 'score'), 'Unknown matching method: ' + str(matching)
+    cand_labels, cand_dets = np.nonzero(candidates)
+    if matching == 'score':
+        order = np.lexsort((-ious[cand_labels, cand_dets], -np.asarray(scores)[cand_dets]))
+    else:
+        order = np.argsort(-ious[cand_labels, cand_dets], kind='stable')
+    label_used = np.zeros(ious.shape[0], dtype=bool)
+    det_used = np.zeros(ious.shape[1], dtype=bool)
+    matches = []
+    for label, det in zip(cand_labels[order], cand_dets[order]):
+        if not label_used[label] and not det_used[det]:
+            label_used[label] = det_used[det] = True
+            matches.append((label, det))
+    matches = np.array(sorted(matches), dtype=np.int64).reshape(-1, 2)
+    return matches[:, 0], matches[:, 1]
 
 
 # compute various performance measures to assess object detection
-def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5):
-    
-     # find best detection for each valid label 
-    true_positives = 0 # no. of correctly detected objects
-    center_devs = []
-    ious = []
-    for label, valid in zip(labels, labels_valid):
-        matches_lab_det = []
-        if valid: # exclude all labels from statistics which are not considered valid
-
-            # compute intersection over union (iou) and distance between centers
-
-            ####### ID_S4_EX1 START #######     
-            #######
-            print("student task ID_S4_EX1 ")
-
-            ## step 1 : extract the four corners of the current label bounding-box
-            bbox_poly = Polygon(tools.compute_box_corners(label.box.center_x, label.box.center_y, label.box.width, label.box.length, label.box.heading))
-            bbox_center = bbox_poly.centroid
-
-            ## step 2 : loop over all detected objects
-            for det in detections:
-                ## step 3 : extract the four corners of the current detection
-                det_poly = Polygon(tools.compute_box_corners(det[1], det[2], det[5], det[6], det[7]))
-                
-                ## step 4 : compute the center distance between label and detection bounding-box in x, y, and z
-                det_poly_center = det_poly.centroid
-
-                dist_x = abs(bbox_center.x - det_poly_center.x)
-                dist_y = abs(bbox_center.y - det_poly_center.y)
-                dist_z = abs(label.box.center_z - det[3])
-
-                ## step 5 : compute the intersection over union (IOU) between label and detection bounding-box
-                intersection = det_poly.intersection(bbox_poly)
-                union = det_poly.union(bbox_poly)
-                iou = intersection.area / union.area
-
-                # ## step 6 : if IOU exceeds min_iou threshold, store [iou, dist_x, dist_y, dist_z] in matches_lab_det and increase the TP count
-                if (iou >= min_iou):
-                    matches_lab_det.append([iou, dist_x, dist_y, dist_z])
-                    true_positives += 1
-
-            #######
-            ####### ID_S4_EX1 END #######     
-        # find best match and compute metrics
-        if matches_lab_det:
-            best_match = max(matches_lab_det,key=itemgetter(1)) # retrieve entry with max iou in case of multiple candidates   
-            ious.append(best_match[0])
-            center_devs.append(best_match[1:])
+def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5, matching='greedy', scores=None):
+
+    # exclude all labels from statistics which are not considered valid
+    valid_labels = [label for label, valid in zip(labels, labels_valid) if valid]
+
+    ####### ID_S4_EX1 START #######     
+    #######
+    print("student task ID_S4_EX1 ")
+
+    ## step 1 : compute the intersection over union (iou) and the distance between centers in x, y, and z
+    ##          for all pairs of valid labels and detections
+    ious_all, center_devs_all = compute_iou_matrix(detections, valid_labels)
+
+    ## step 2 : match each label with at most one detection with iou >= min_iou and vice versa
+    label_idx, det_idx = match_labels_and_detections(ious_all, min_iou, matching, scores)
+
+    ## step 3 : store iou and [dist_x, dist_y, dist_z] of each match, every match is a true positive
+    ious = ious_all[label_idx, det_idx].tolist()
+    center_devs = center_devs_all[label_idx, det_idx].tolist()
+    true_positives = len(label_idx)
+
+    #######
+    ####### ID_S4_EX1 END #######     
 
 
     ####### ID_S4_EX2 START #######     
@@ -108,18 +129,9 @@ def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5)
     return det_performance
 
 
-# evaluate object detection performance based on all frames
-def compute_performance_stats(det_performance_all):
+# compute precision and recall from the positives and negatives of all frames
+def compute_precision_recall(pos_negs):
 
-    # extract elements
-    ious = []
-    center_devs = []
-    pos_negs = []
-    for item in det_performance_all:
-        ious.append(item[0])
-        center_devs.append(item[1])
-        pos_negs.append(item[2])
-    
     ####### ID_S4_EX3 START #######     
     #######    
     print('student task ID_S4_EX3')
@@ -135,6 +147,23 @@ def compute_performance_stats(det_performance_all):
 
     #######    
     ####### ID_S4_EX3 END #######     
+
+    return precision, recall
+
+
+# evaluate object detection performance based on all frames
+def compute_performance_stats(det_performance_all):
+
+    # extract elements
+    ious = []
+    center_devs = []
+    pos_negs = []
+    for item in det_performance_all:
+        ious.append(item[0])
+        center_devs.append(item[1])
+        pos_negs.append(item[2])
+    
+    precision, recall = compute_precision_recall(pos_negs)
     print('precision = ' + str(precision) + ", recall = " + str(recall))   
 
     # serialize intersection-over-union and deviations in x,y,z
@@ -185,3 +214,204 @@ def compute_performance_stats(det_performance_all):
     plt.tight_layout()
     plt.show()
 
+
+
+# combine count, mean and sum of squared differences of two sets of samples (parallel algorithm of Chan et al.),
+# the means have one more dimension than the counts
+def combine_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    count = count_a + count_b
+    ratio = np.expand_dims(count_b / np.maximum(count, 1), -1)
+    delta = mean_b - mean_a
+    return count, mean_a + delta * ratio, m2_a + m2_b + delta ** 2 * np.expand_dims(count_a, -1) * ratio
+
+
+# accumulate detection performance frame by frame, e.g. over many segments
+class DetectionMetrics:
+    """ Streaming accumulator of scored detections and labels, which yields AP / mAP, precision-recall curves and
+    statistics of the iou and the center deviations, both overall and per range bin.
+
+    Nothing is kept per frame: each detection adds its score, its true positive flag, its class and its range bin to
+    compact arrays sorted by score, each label of a class adds to a count per range bin, and the ious and center
+    deviations of the matches only update running moments and fixed histograms. Partial results, e.g. of different
+    processes, can be combined with merge.
+    """
+
+    quantities = ['iou', 'dev_x', 'dev_y', 'dev_z']
+
+    def __init__(self, min_iou=0.5, range_edges=(0, 10, 20, 30, 40, 50), num_hist_bins=20, max_dev=1.0):
+        self.min_iou = min_iou
+        self.range_edges = np.asarray(range_edges, dtype=np.float64)
+        num_ranges = len(self.range_edges) - 1
+
+        # upper limits of the histograms, the lower limit is 0 for all quantities, larger values go into the last bin
+        self.hist_limits = np.array([1.0, max_dev, max_dev, max_dev])
+        self.num_hist_bins = num_hist_bins
+
+        self.num_frames = 0
+        self.num_labels = {} # class --> number of valid labels per range bin
+
+        # scores, true positive flags, classes and range bins of all detections
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.tp = np.zeros(0, dtype=bool)
+        self.classes = np.zeros(0, dtype=np.int16)
+        self.ranges = np.zeros(0, dtype=np.int8)
+        self.pending = [] # detections of the frames since the arrays were last sorted
+
+        # count, mean and sum of squared differences of each quantity per range bin, and their histograms
+        self.count = np.zeros(num_ranges, dtype=np.int64)
+        self.mean = np.zeros((num_ranges, len(self.quantities)))
+        self.m2 = np.zeros((num_ranges, len(self.quantities)))
+        self.hist = np.zeros((num_ranges, len(self.quantities), num_hist_bins), dtype=np.int64)
+
+    def range_bins(self, x, y):
+        distances = np.hypot(x, y)
+        return np.clip(np.searchsorted(self.range_edges, distances, side='right') - 1, 0, len(self.range_edges) - 2)
+
+    def update(self, detections, scores, labels, labels_valid):
+        """ Add a frame with (N, 8) detections [cls, x, y, z, h, w, l, yaw], their (N,) scores and its labels.
+
+        Returns the match table [scores, tp, num_positives] of the frame. As the detections pick their labels in the
+        order of their scores, the true positives of any confidence threshold are those among the detections above it.
+        """
+        detections = np.asarray(detections, dtype=np.float64).reshape(-1, 8)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        valid_labels = [label for label, valid in zip(labels, labels_valid) if valid]
+        self.num_frames += 1
+
+        # match detections in the order of their scores, only labels and detections of the same class can match
+        ious, center_devs = compute_iou_matrix(detections, valid_labels)
+        label_classes = np.array([label.type for label in valid_labels], dtype=np.int64)
+        ious[label_classes[:, None] != detections[None, :, 0]] = 0.0
+        label_idx, det_idx = match_labels_and_detections(ious, self.min_iou, 'score', scores)
+
+        # labels and true positives are assigned to the range bin of the label, false positives to that of their own
+        # center, so that the precision and recall of a range bin refer to the same labels
+        label_centers = np.array([[label.box.center_x, label.box.center_y] for label in valid_labels]).reshape(-1, 2)
+        label_ranges = self.range_bins(label_centers[:, 0], label_centers[:, 1])
+        tp = np.zeros(len(detections), dtype=bool)
+        tp[det_idx] = True
+        det_ranges = self.range_bins(detections[:, 1], detections[:, 2])
+        det_ranges[det_idx] = label_ranges[label_idx]
+        self.pending.append((scores, tp, detections[:, 0].astype(np.int16), det_ranges.astype(np.int8)))
+
+        for cls in np.unique(label_classes):
+            counts = np.bincount(label_ranges[label_classes == cls], minlength=len(self.count))
+            self.num_labels[int(cls)] = self.num_labels.get(int(cls), 0) + counts
+
+        # combine the moments of the matches of this frame with the accumulated ones
+        values = np.column_stack((ious[label_idx, det_idx], center_devs[label_idx, det_idx]))
+        match_ranges = label_ranges[label_idx]
+        count = np.bincount(match_ranges, minlength=len(self.count))
+        mean = np.zeros_like(self.mean)
+        m2 = np.zeros_like(self.m2)
+        for idx in range(len(self.quantities)):
+            mean[:, idx] = np.bincount(match_ranges, weights=values[:, idx], minlength=len(self.count)) / np.maximum(count, 1)
+            m2[:, idx] = np.bincount(match_ranges, weights=(values[:, idx] - mean[match_ranges, idx]) ** 2, minlength=len(self.count))
+        self.merge_moments(count, mean, m2)
+
+        hist_bins = np.minimum((values / self.hist_limits * self.num_hist_bins).astype(np.int64), self.num_hist_bins - 1)
+        for idx in range(len(self.quantities)):
+            np.add.at(self.hist[:, idx], (match_ranges, hist_bins[:, idx]), 1)
+
+        # sort the detections into the arrays from time to time, so that the list of pending frames stays short
+        if len(self.pending) >= 100:
+            self.sort_detections()
+
+        return [scores, tp, len(valid_labels)]
+
+    def merge_moments(self, count, mean, m2):
+        self.count, self.mean, self.m2 = combine_moments(self.count, self.mean, self.m2, count, mean, m2)
+
+    def sort_detections(self):
+        if self.pending:
+            # only the pending detections are sorted, then merged into the sorted arrays, after any equal scores
+            scores, tp, classes, ranges = (np.concatenate(arrays) for arrays in zip(*self.pending))
+            self.pending = []
+            order = np.argsort(-scores, kind='stable')
+            positions = np.searchsorted(-self.scores, -scores[order], side='right')
+            self.scores = np.insert(self.scores, positions, scores[order])
+            self.tp = np.insert(self.tp, positions, tp[order])
+            self.classes = np.insert(self.classes, positions, classes[order])
+            self.ranges = np.insert(self.ranges, positions, ranges[order])
+
+    def merge(self, other):
+        """ Add the accumulated results of another DetectionMetrics with the same settings """
+        assert np.array_equal(self.range_edges, other.range_edges) and self.min_iou == other.min_iou, 'Incompatible detection metrics'
+        assert np.array_equal(self.hist_limits, other.hist_limits) and self.num_hist_bins == other.num_hist_bins, 'Incompatible detection metrics'
+        other.sort_detections()
+        self.pending.append((other.scores, other.tp, other.classes, other.ranges))
+        self.sort_detections()
+        for cls, counts in other.num_labels.items():
+            self.num_labels[cls] = self.num_labels.get(cls, 0) + counts
+        self.num_frames += other.num_frames
+        self.merge_moments(other.count, other.mean, other.m2)
+        self.hist += other.hist
+        return self
+
+    def select(self, range_bin=None):
+        # detections and numbers of labels per class, optionally of a single range bin only
+        self.sort_detections()
+        selected = slice(None) if range_bin is None else (self.ranges == range_bin)
+        num_labels = {cls: counts.sum() if range_bin is None else counts[range_bin] for cls, counts in self.num_labels.items()}
+        return self.scores[selected], self.tp[selected], self.classes[selected], num_labels
+
+    def average_precision(self, range_bin=None):
+        """ Returns precision, recall, ap, f1 and the classes as computed by ap_per_class """
+        scores, tp, classes, num_labels = self.select(range_bin)
+        target_classes = np.repeat(np.array(list(num_labels.keys()), dtype=np.int64), list(num_labels.values()))
+        return ap_per_class(tp.astype(np.float64), scores, classes, target_classes)
+
+    def pr_curve(self, cls=1, range_bin=None):
+        """ Returns precision, recall and score threshold of each point of the precision-recall curve of a class """
+        scores, tp, classes, num_labels = self.select(range_bin)
+        is_class = classes == cls
+        tpc = np.cumsum(tp[is_class])
+        fpc = np.cumsum(~tp[is_class])
+        return tpc / np.maximum(tpc + fpc, 1), tpc / max(num_labels.get(cls, 0), 1), scores[is_class]
+
+    def report(self):
+        """ Returns all results as a dictionary of plain python types, e.g. to be stored as json """
+        def _statistics(count, mean, m2, hist):
+            return {name: {'count': int(count), 'mean': float(mean[idx]), 'std': float(np.sqrt(m2[idx] / max(count, 1))),
+                           'hist': hist[idx].tolist(), 'hist_edges': np.linspace(0, self.hist_limits[idx], self.num_hist_bins + 1).tolist()}
+                    for idx, name in enumerate(self.quantities)}
+
+        def _ap(range_bin):
+            precision, recall, ap, f1, classes = self.average_precision(range_bin)
+            return {'mAP': float(ap.mean()) if len(ap) else 0.0,
+                    'classes': {int(cls): {'ap': float(ap[idx]), 'precision': float(precision[idx]), 'recall': float(recall[idx]), 'f1': float(f1[idx])}
+                                for idx, cls in enumerate(classes)}}
+
+        # the moments of all ranges follow from combining those of the range bins
+        count, mean, m2 = self.count[0], self.mean[0], self.m2[0]
+        for range_bin in range(1, len(self.count)):
+            count, mean, m2 = combine_moments(count, mean, m2, self.count[range_bin], self.mean[range_bin], self.m2[range_bin])
+
+        self.sort_detections()
+        report = {'num_frames': self.num_frames, 'min_iou': self.min_iou, 'num_detections': len(self.scores),
+                  'num_labels': {int(cls): int(counts.sum()) for cls, counts in self.num_labels.items()},
+                  **_ap(None), 'statistics': _statistics(count, mean, m2, self.hist.sum(axis=0)), 'ranges': []}
+        for range_bin in range(len(self.count)):
+            report['ranges'].append({'range': self.range_edges[range_bin:range_bin + 2].tolist(),
+                                     'num_labels': {int(cls): int(counts[range_bin]) for cls, counts in self.num_labels.items()},
+                                     **_ap(range_bin), 'statistics': _statistics(self.count[range_bin], self.mean[range_bin], self.m2[range_bin], self.hist[range_bin])})
+        return report
+
+    def plot(self, cls=1):
+        """ Shows the precision-recall curves of a class overall and per range bin, and the histograms of all matches """
+        f, a = plt.subplots(1, 1 + len(self.quantities), figsize=(20, 4))
+        for range_bin in [None] + list(range(len(self.count))):
+            precision, recall, _ = self.pr_curve(cls, range_bin)
+            name = 'all' if range_bin is None else '{:.0f}-{:.0f} m'.format(*self.range_edges[range_bin:range_bin + 2])
+            a[0].plot(recall, precision, label=name, linewidth=(2 if range_bin is None else 1))
+        a[0].set_xlabel('recall')
+        a[0].set_ylabel('precision')
+        a[0].set_title('precision-recall curves')
+        a[0].legend()
+        hist = self.hist.sum(axis=0)
+        for idx, (ax, name) in enumerate(zip(a[1:], self.quantities)):
+            edges = np.linspace(0, self.hist_limits[idx], self.num_hist_bins + 1)
+            ax.stairs(hist[idx], edges, fill=True)
+            ax.set_title(name)
+        plt.tight_layout()
+        plt.show()
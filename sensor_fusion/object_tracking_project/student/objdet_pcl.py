@@ -14,7 +14,6 @@
 import cv2
 import numpy as np
 import torch
-import zlib
 import open3d as o3d
 
 # add project directory to python path to enable relative imports
@@ -26,7 +25,6 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 # waymo open dataset reader
 from tools.waymo_reader.simple_waymo_open_dataset_reader import utils as waymo_utils
-from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2, label_pb2
 
 # object detection tools and helper functions
 import misc.objdet_tools as tools
@@ -74,9 +72,7 @@ def show_range_image(frame, lidar_name):
     range_image = []
     # Use only the first return from objects
     if len(lidar.ri_return1.range_image_compressed) > 0:
-        range_image = dataset_pb2.MatrixFloat()
-        range_image.ParseFromString(zlib.decompress(lidar.ri_return1.range_image_compressed))
-        range_image = np.array(range_image.data).reshape(range_image.shape.dims)
+        range_image = waymo_utils.decompress_matrix_float(lidar.ri_return1.range_image_compressed)
 
     # step 2 : extract the range and the intensity channel from the range image
     # step 3 : set values <0 to zero
@@ -108,109 +104,140 @@ def show_range_image(frame, lidar_name):
     return img_range_intensity
 
 
-# create birds-eye view of lidar data
-def bev_from_pcl(lidar_pcl, configs):
-
-    # remove lidar points outside detection area and with too low reflectivity
-    mask = np.where((lidar_pcl[:, 0] >= configs.lim_x[0]) & (lidar_pcl[:, 0] <= configs.lim_x[1]) &
-                    (lidar_pcl[:, 1] >= configs.lim_y[0]) & (lidar_pcl[:, 1] <= configs.lim_y[1]) &
-                    (lidar_pcl[:, 2] >= configs.lim_z[0]) & (lidar_pcl[:, 2] <= configs.lim_z[1]))
-    lidar_pcl = lidar_pcl[mask]
-    
-    # shift level of ground plane to avoid flipping from 0 to 255 for neighboring pixels
-    lidar_pcl[:, 2] = lidar_pcl[:, 2] - configs.lim_z[0]  
-
-    # convert sensor coordinates to bev-map coordinates (center is bottom-middle)
-    ####### ID_S2_EX1 START #######     
-    #######
-    print("student task ID_S2_EX1")
-    ## step 1 :  compute bev-map discretization by dividing x-range by the bev-image height (see configs)
-    bev_discret = (configs.lim_x[1] - configs.lim_x[0]) / configs.bev_height
-
-    ## step 2 : create a copy of the lidar pcl and transform all metrix x-coordinates into bev-image coordinates    
-    lidar_pcl_cpy = np.copy(lidar_pcl)
-    # Making all the x-coordinates falls under the same cell corresponds to same x-value
-    lidar_pcl_cpy[:, 0] = np.int_(np.floor(lidar_pcl_cpy[:, 0] / bev_discret))
-    # step 3 : perform the same operation as in step 2 for the y-coordinates but make sure that no negative bev-coordinates occur
-    lidar_pcl_cpy[:, 1] = np.int_(np.floor(lidar_pcl_cpy[:, 1] / bev_discret) + (configs.bev_width + 1) / 2)
-    
-    # step 4 : visualize point-cloud using the function show_pcl from a previous task
-    # show_pcl(lidar_pcl_cpy)
-    #######
-    ####### ID_S2_EX1 END #######     
-    
-    
-    # Compute intensity layer of the BEV map
-    ####### ID_S2_EX2 START #######     
-    #######
-    print("student task ID_S2_EX2")
-
-    ## step 1 : create a numpy array filled with zeros which has the same dimensions as the BEV map
-    intensity_map = np.zeros((configs.bev_height + 1, configs.bev_height + 1))
-    
-    # step 2 : re-arrange elements in lidar_pcl_cpy by sorting first by x, then y, then -z (use numpy.lexsort)
-    idx_height = np.lexsort((-lidar_pcl_cpy[:, 2], lidar_pcl_cpy[:, 1], lidar_pcl_cpy[:, 0]))
-    lidar_pcl_top = lidar_pcl_cpy[idx_height]
-
-    ## step 3 : extract all points with identical x and y such that only the top-most z-coordinate is kept (use numpy.unique)
-    ##          also, store the number of points per x,y-cell in a variable named "counts" for use in the next task
-    _, idx_height_unique, counts = np.unique(lidar_pcl_top[:, 0:2], axis=0, return_index=True, return_counts=True)
-    lidar_pcl_top = lidar_pcl_top[idx_height_unique]
-
-    ## step 4 : assign the intensity value of each unique entry in lidar_pcl_top to the intensity map 
-    ##          make sure that the intensity is scaled in such a way that objects of interest (e.g. vehicles) are clearly visible    
-    ##          also, make sure that the influence of outliers is mitigated by normalizing intensity on the difference between the max. and min. value within the point cloud
-    lidar_pcl_top[lidar_pcl_top[:, 3] > 1.0, 3] = 1.0
-    intensity_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = lidar_pcl_top[:, 3] / (np.amax(lidar_pcl_top[:, 3]) - np.amin(lidar_pcl_top[:, 3]))
-
-    ## step 5 : temporarily visualize the intensity map using OpenCV to make sure that vehicles separate well from the background
-    # img_intensity = intensity_map * 256
-    # img_intensity = img_intensity.astype(np.uint8)
-    # cv2.imshow('img_intensity', img_intensity)
-    # cv2.waitKey(0)
-
-    #######
-    ####### ID_S2_EX2 END ####### 
+# rasterize lidar point-clouds into birds-eye view maps, reusing all buffers from frame to frame
+class BevRasterizer:
+    """ Converts point-clouds into a (1, 3, bev_height, bev_width) float32 tensor of intensity, height and density.
+
+    The output tensor and all per-cell work buffers are allocated once. Every call overwrites the tensor returned
+    by the previous call, so it has to be consumed (e.g. by the detection model) before the next frame is processed.
+    If the model runs on a cuda device, the maps are written into pinned host memory and copied into a persistent
+    tensor on that device.
+    """
+
+    def __init__(self, configs):
+        self.configs = configs
+        self.dtype = np.dtype(configs.precision) # precision of the intermediate computations
+        self.device = torch.device(configs.device)
+
+        # the bev grid has one additional row and column for points on the upper x- and y-limit
+        self.bev_cols = configs.bev_width + 1
+        num_cells = (configs.bev_height + 1) * self.bev_cols
+        self.max_height = np.empty(num_cells, dtype=self.dtype)
+        self.top_point = np.empty(num_cells, dtype=np.int64)
+
+        # host buffer of the bev maps, its channels are written through a numpy view
+        shape = (1, 3, configs.bev_height, configs.bev_width)
+        self.host_bev_maps = torch.zeros(shape, dtype=torch.float32, pin_memory=(self.device.type == 'cuda'))
+        self.channels = self.host_bev_maps.numpy().reshape(3, -1)
+        if self.device.type == 'cpu':
+            self.bev_maps = self.host_bev_maps
+        else:
+            self.bev_maps = torch.zeros(shape, dtype=torch.float32, device=self.device)
+
+    def __call__(self, lidar_pcl):
+        configs = self.configs
+
+        # remove lidar points outside detection area and with too low reflectivity
+        mask = np.where((lidar_pcl[:, 0] >= configs.lim_x[0]) & (lidar_pcl[:, 0] <= configs.lim_x[1]) &
+                        (lidar_pcl[:, 1] >= configs.lim_y[0]) & (lidar_pcl[:, 1] <= configs.lim_y[1]) &
+                        (lidar_pcl[:, 2] >= configs.lim_z[0]) & (lidar_pcl[:, 2] <= configs.lim_z[1]))
+        lidar_pcl = lidar_pcl[mask].astype(self.dtype, copy=False)
+
+        # shift level of ground plane to avoid flipping from 0 to 255 for neighboring pixels
+        lidar_pcl[:, 2] = lidar_pcl[:, 2] - configs.lim_z[0]
+        height = lidar_pcl[:, 2]
+        intensity = lidar_pcl[:, 3]
+
+        # convert sensor coordinates to bev-map coordinates (center is bottom-middle)
+        ####### ID_S2_EX1 START #######     
+        #######
+        print("student task ID_S2_EX1")
+        ## step 1 :  compute bev-map discretization by dividing x-range by the bev-image height (see configs)
+        bev_discret = (configs.lim_x[1] - configs.lim_x[0]) / configs.bev_height
+
+        ## step 2 : transform all metric x-coordinates into bev-image coordinates
+        cell_x = np.int_(np.floor(lidar_pcl[:, 0] / bev_discret))
+        # step 3 : perform the same operation as in step 2 for the y-coordinates but make sure that no negative bev-coordinates occur
+        cell_y = np.int_(np.floor(lidar_pcl[:, 1] / bev_discret) + (configs.bev_width + 1) / 2)
+        # linear index of the bev cell of each point
+        cells = cell_x * self.bev_cols + cell_y
+
+        # step 4 : visualize point-cloud using the function show_pcl from a previous task
+        # show_pcl(lidar_pcl)
+        #######
+        ####### ID_S2_EX1 END #######     
+
+
+        # Compute intensity layer of the BEV map
+        ####### ID_S2_EX2 START #######     
+        #######
+        print("student task ID_S2_EX2")
+
+        ## step 1 : clear the preallocated bev maps, the intensity map is their channel 0
+        self.channels.fill(0)
+
+        # step 2 : find the top-most point of each cell, i.e. the point with the maximum z-coordinate
+        self.max_height.fill(-np.inf)
+        np.maximum.at(self.max_height, cells, height)
+        idx_top = np.flatnonzero(height == self.max_height[cells])
+
+        ## step 3 : keep only one top-most point per cell, several points of a cell may share the maximum height,
+        ##          then the first one is kept (as a stable sort would)
+        self.top_point.fill(len(lidar_pcl))
+        np.minimum.at(self.top_point, cells[idx_top], idx_top)
+        occupied_cells = np.flatnonzero(self.top_point < len(lidar_pcl))
+        top_point = self.top_point[occupied_cells]
+
+        # pixels of the occupied cells inside the bev image
+        rows, cols = np.divmod(occupied_cells, self.bev_cols)
+        inside = (rows < configs.bev_height) & (cols < configs.bev_width)
+        pixels = rows[inside] * configs.bev_width + cols[inside]
+
+        ## step 4 : assign the intensity value of the top-most point of each cell to the intensity map 
+        ##          make sure that the influence of outliers is mitigated by normalizing intensity on the difference between the max. and min. value
+        top_intensity = intensity[top_point]
+        top_intensity[top_intensity > 1.0] = 1.0
+        intensity_values = top_intensity / (np.amax(top_intensity) - np.amin(top_intensity))
+        self.channels[0, pixels] = intensity_values[inside] # b_map
+
+        #######
+        ####### ID_S2_EX2 END ####### 
+
+        # Compute height layer of the BEV map
+        ####### ID_S2_EX3 START #######     
+        #######
+        print("student task ID_S2_EX3")
+
+        ## step 1 : assign the height value of the top-most point of each cell to the height map (channel 1)
+        ##          make sure that each entry is normalized on the difference between the upper and lower height defined in the config file
+        height_values = height[top_point] / float(np.abs(configs.lim_z[1] - configs.lim_z[0]))
+        self.channels[1, pixels] = height_values[inside] # g_map
+
+        #######
+        ####### ID_S2_EX3 END #######       
+
+        # Compute density layer of the BEV map from the number of points per cell
+        counts = np.bincount(cells)[occupied_cells]
+        density_values = np.minimum(1.0, np.log(counts + 1) / np.log(64))
+        self.channels[2, pixels] = density_values[inside] # r_map
+
+        if self.bev_maps is not self.host_bev_maps:
+            self.bev_maps.copy_(self.host_bev_maps)
+        return self.bev_maps
+
+
+# rasterizers used by bev_from_pcl, one per bev grid, precision and device
+_bev_rasterizers = {}
 
-    # Compute height layer of the BEV map
-    ####### ID_S2_EX3 START #######     
-    #######
-    print("student task ID_S2_EX3")
-
-    ## step 1 : create a numpy array filled with zeros which has the same dimensions as the BEV map
-    height_map = np.zeros((configs.bev_height + 1, configs.bev_height + 1))
 
-    ## step 2 : assign the height value of each unique entry in lidar_pcl_top to the height map 
-    ##          make sure that each entry is normalized on the difference between the upper and lower height defined in the config file
-    ##          use the lidar_pcl_top data structure from the previous task to access the pixels of the height_map
-    height_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = lidar_pcl_top[:, 2] / float(np.abs(configs.lim_z[1] - configs.lim_z[0]))
+# create birds-eye view of lidar data
+def bev_from_pcl(lidar_pcl, configs):
 
-    ## step 3 : temporarily visualize the intensity map using OpenCV to make sure that vehicles separate well from the background
-    # img_height = height_map * 256
-    # img_height = img_height.astype(np.uint8)
-    # cv2.imshow('img_height', img_height)
-    # cv2.waitKey(0)
+    # the rasterizer and its buffers are reused for all frames, the returned tensor is a copy owned by the caller
+    key = (configs.bev_height, configs.bev_width, np.dtype(configs.precision).name, str(configs.device))
+    if key not in _bev_rasterizers:
+        _bev_rasterizers[key] = BevRasterizer(configs)
+    rasterizer = _bev_rasterizers[key]
+    rasterizer.configs = configs # detection area of the current configs
+    return rasterizer(lidar_pcl).clone()
 
-    #######
-    ####### ID_S2_EX3 END #######       
-
-    # Compute density layer of the BEV map
-    density_map = np.zeros((configs.bev_height + 1, configs.bev_width + 1))
-    _, _, counts = np.unique(lidar_pcl_cpy[:, 0:2], axis=0, return_index=True, return_counts=True)
-    normalizedCounts = np.minimum(1.0, np.log(counts + 1) / np.log(64)) 
-    density_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = normalizedCounts
-        
-    # assemble 3-channel bev-map from individual maps
-    bev_map = np.zeros((3, configs.bev_height, configs.bev_width))
-    bev_map[2, :, :] = density_map[:configs.bev_height, :configs.bev_width]  # r_map
-    bev_map[1, :, :] = height_map[:configs.bev_height, :configs.bev_width]  # g_map
-    bev_map[0, :, :] = intensity_map[:configs.bev_height, :configs.bev_width]  # b_map
-
-    # expand dimension of bev_map before converting into a tensor
-    s1, s2, s3 = bev_map.shape
-    bev_maps = np.zeros((1, s1, s2, s3))
-    bev_maps[0] = bev_map
-
-    bev_maps = torch.from_numpy(bev_maps)  # create tensor from birds-eye view
-    input_bev_maps = bev_maps.to(configs.device, non_blocking=True).float()
-    return input_bev_maps
@@ -22,10 +22,47 @@ SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 import misc.params as params 
 
+class TrackTable:
+    '''Structure of arrays with the states (N, 6) and covariances (N, 6, 6) of all tracks, one row per track'''
+    def __init__(self, capacity=16):
+        self.x = np.zeros((capacity, params.dim_state))
+        self.P = np.zeros((capacity, params.dim_state, params.dim_state))
+        self.tracks = [] # track of each row
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def add(self, track):
+        # double the capacity if all rows are in use
+        if len(self.tracks) == len(self.x):
+            self.x = np.concatenate((self.x, np.zeros_like(self.x)))
+            self.P = np.concatenate((self.P, np.zeros_like(self.P)))
+        track.table, track.row = self, len(self.tracks)
+        self.tracks.append(track)
+
+    def remove(self, track):
+        row, last = track.row, len(self.tracks) - 1
+
+        # the removed track keeps its last state and covariance in a table of its own
+        detached = TrackTable(capacity=1)
+        detached.x[0], detached.P[0] = self.x[row], self.P[row]
+        detached.add(track)
+
+        # move the last row into the free one
+        if row != last:
+            self.x[row], self.P[row] = self.x[last], self.P[last]
+            self.tracks[row] = self.tracks[last]
+            self.tracks[row].row = row
+        self.tracks.pop()
+
+###################        
+
 class Track:
     '''Track class with state, covariance, id, score'''
-    def __init__(self, meas, id):
+    def __init__(self, meas, id, table=None):
         print('creating track no.', id)
+        # x and P are views into a row of the track table
+        (TrackTable(capacity=1) if table is None else table).add(self)
         M_rot = meas.sensor.sens_to_veh[0:3, 0:3] # rotation matrix from sensor to vehicle coordinates
         P_pos = M_rot * meas.R * np.transpose(M_rot)
         
@@ -65,6 +102,22 @@ class Track:
         self.yaw =  np.arccos(M_rot[0,0]*np.cos(meas.yaw) + M_rot[0,1]*np.sin(meas.yaw)) # transform rotation from sensor to vehicle coordinates
         self.t = meas.t
 
+    @property
+    def x(self):
+        return np.asmatrix(self.table.x[self.row].reshape(-1, 1))
+
+    @x.setter
+    def x(self, x):
+        self.table.x[self.row] = np.asarray(x).reshape(-1)
+
+    @property
+    def P(self):
+        return np.asmatrix(self.table.P[self.row])
+
+    @P.setter
+    def P(self, P):
+        self.table.P[self.row] = P
+
     def set_x(self, x):
         self.x = x
         
@@ -94,6 +147,7 @@ class Trackmanagement:
         self.track_list = []
         self.last_id = -1
         self.result_list = []
+        self.table = TrackTable() # states and covariances of all tracks in track_list
         
     def manage_tracks(self, unassigned_tracks, unassigned_meas, meas_list):  
         ############
@@ -139,12 +193,13 @@ class Trackmanagement:
         self.last_id = track.id
 
     def init_track(self, meas):
-        track = Track(meas, self.last_id + 1)
+        track = Track(meas, self.last_id + 1, self.table)
         self.addTrackToList(track)
 
     def delete_track(self, track):
         print('deleting track no.', track.id)
         self.track_list.remove(track)
+        self.table.remove(track)
         
     def handle_updated_track(self, track):      
         ############
@@ -0,0 +1,38 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Tests of the multi-object tracking metrics
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+## general package imports
+import os
+import sys
+
+## Add the project directory to path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+
+from misc.mot_metrics import TrackingMetrics
+
+
+## A track which has been taken over by another ground truth object is kept for only one of them
+def test_track_is_kept_for_one_ground_truth_object():
+
+    metrics = TrackingMetrics(max_dist=2.0)
+    metrics.update(['A'], [[0.0, 0.0, 0.0]], [1], [[0.0, 0.0, 0.0]])
+    metrics.update(['B'], [[0.5, 0.0, 0.0]], [1], [[0.5, 0.0, 0.0]])
+    rows, cols = metrics.update(['A', 'B'], [[0.0, 0.0, 0.0], [0.6, 0.0, 0.0]], [1], [[0.5, 0.0, 0.0]])
+
+    # B holds track 1 since frame 2, A is missed
+    assert rows.tolist() == [1] and cols.tolist() == [0]
+    report = metrics.report()
+    assert report['num_matches'] == 3
+    assert report['num_false_positives'] == 0
+    assert report['num_misses'] == 1
+    assert report['num_switches'] == 0
+    assert report['mota'] == 0.75
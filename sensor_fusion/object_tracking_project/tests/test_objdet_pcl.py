@@ -0,0 +1,131 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Tests of the lidar point-cloud processing
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+## general package imports
+import os
+import sys
+import numpy as np
+import pytest
+import torch
+
+## Add the project directory to path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+
+## Waymo open dataset reader
+from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+
+import misc.objdet_tools as tools
+import student.objdet_pcl as pcl
+import student.objdet_detect as det
+
+
+## Original float64 computation of the bev map, step by step with lexsort and np.unique, as (3, bev_height, bev_width) array
+def reference_bev_from_pcl(lidar_pcl, configs):
+
+    # remove lidar points outside detection area and shift level of ground plane
+    mask = np.where((lidar_pcl[:, 0] >= configs.lim_x[0]) & (lidar_pcl[:, 0] <= configs.lim_x[1]) &
+                    (lidar_pcl[:, 1] >= configs.lim_y[0]) & (lidar_pcl[:, 1] <= configs.lim_y[1]) &
+                    (lidar_pcl[:, 2] >= configs.lim_z[0]) & (lidar_pcl[:, 2] <= configs.lim_z[1]))
+    lidar_pcl = lidar_pcl[mask].astype(np.float64)
+    lidar_pcl[:, 2] = lidar_pcl[:, 2] - configs.lim_z[0]
+
+    # convert sensor coordinates to bev-map coordinates
+    bev_discret = (configs.lim_x[1] - configs.lim_x[0]) / configs.bev_height
+    lidar_pcl_cpy = np.copy(lidar_pcl)
+    lidar_pcl_cpy[:, 0] = np.int_(np.floor(lidar_pcl_cpy[:, 0] / bev_discret))
+    lidar_pcl_cpy[:, 1] = np.int_(np.floor(lidar_pcl_cpy[:, 1] / bev_discret) + (configs.bev_width + 1) / 2)
+
+    # keep the top-most point of each cell
+    idx_height = np.lexsort((-lidar_pcl_cpy[:, 2], lidar_pcl_cpy[:, 1], lidar_pcl_cpy[:, 0]))
+    lidar_pcl_top = lidar_pcl_cpy[idx_height]
+    _, idx_height_unique, counts = np.unique(lidar_pcl_top[:, 0:2], axis=0, return_index=True, return_counts=True)
+    lidar_pcl_top = lidar_pcl_top[idx_height_unique]
+    rows, cols = np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])
+
+    # intensity, height and density layers
+    intensity_map = np.zeros((configs.bev_height + 1, configs.bev_width + 1))
+    lidar_pcl_top[lidar_pcl_top[:, 3] > 1.0, 3] = 1.0
+    intensity_map[rows, cols] = lidar_pcl_top[:, 3] / (np.amax(lidar_pcl_top[:, 3]) - np.amin(lidar_pcl_top[:, 3]))
+    height_map = np.zeros((configs.bev_height + 1, configs.bev_width + 1))
+    height_map[rows, cols] = lidar_pcl_top[:, 2] / float(np.abs(configs.lim_z[1] - configs.lim_z[0]))
+    density_map = np.zeros((configs.bev_height + 1, configs.bev_width + 1))
+    density_map[rows, cols] = np.minimum(1.0, np.log(counts + 1) / np.log(64))
+
+    bev_map = np.zeros((3, configs.bev_height, configs.bev_width))
+    bev_map[2] = density_map[:configs.bev_height, :configs.bev_width]  # r_map
+    bev_map[1] = height_map[:configs.bev_height, :configs.bev_width]  # g_map
+    bev_map[0] = intensity_map[:configs.bev_height, :configs.bev_width]  # b_map
+    return bev_map
+
+
+## Point-clouds of a synthetic range image of a roof lidar 1.8 m above ground with a small yaw offset, in both precisions
+@pytest.fixture(scope='module')
+def point_clouds():
+
+    calibration = dataset_pb2.LaserCalibration()
+    calibration.name = dataset_pb2.LaserName.TOP
+    calibration.beam_inclination_min = -0.3
+    calibration.beam_inclination_max = 0.04
+    calibration.extrinsic.transform.extend([np.cos(0.01), -np.sin(0.01), 0, 1.4,
+                                            np.sin(0.01),  np.cos(0.01), 0, 0.0,
+                                            0, 0, 1, 1.8,
+                                            0, 0, 0, 1])
+
+    rng = np.random.default_rng(0)
+    range_image = np.zeros((64, 2650, 4), dtype=np.float32)
+    range_image[:, :, 0] = rng.uniform(1.0, 75.0, size=(64, 2650))
+    range_image[:, :, 1] = rng.exponential(0.2, size=(64, 2650))
+    range_image[rng.random((64, 2650)) < 0.1, 0] = -1.0
+
+    point_clouds = {}
+    for precision in ('float64', 'float32'):
+        points, attributes = tools.project_to_pointcloud(None, range_image, None, None, calibration, np.dtype(precision))
+        point_clouds[precision] = np.column_stack((points, attributes[:, 1]))
+    return point_clouds
+
+
+@pytest.fixture(scope='module')
+def configs():
+    configs = det.load_configs(model_name='darknet')
+    configs.device = torch.device('cpu')
+    return configs
+
+
+def test_float32_point_cloud_matches_float64(point_clouds):
+    assert point_clouds['float32'].dtype == np.float32 and point_clouds['float64'].dtype == np.float64
+    assert np.abs(point_clouds['float32'] - point_clouds['float64']).max() < 1e-4
+
+
+## Both precisions of the rasterizer are compared channel by channel against the original float64 computation, in float32
+## points close to a cell border may end up in the neighboring cell, all other pixels have to agree
+@pytest.mark.parametrize('precision, max_differing_ratio', [('float64', 0.0), ('float32', 1e-3)])
+def test_bev_from_pcl_matches_reference(point_clouds, configs, precision, max_differing_ratio):
+
+    reference = reference_bev_from_pcl(point_clouds['float64'], configs)
+    configs.precision = precision
+    bev_maps = pcl.bev_from_pcl(point_clouds[precision], configs)
+    assert bev_maps.shape == (1, 3, configs.bev_height, configs.bev_width) and bev_maps.dtype == torch.float32
+
+    for channel, name in enumerate(('intensity', 'height', 'density')):
+        differing = np.abs(bev_maps[0, channel].numpy() - reference[channel]) > 1e-5
+        assert differing.mean() <= max_differing_ratio, '{} layer deviates from the reference'.format(name)
+
+
+## Each call returns its own tensor, which is not overwritten by the next frame
+def test_bev_from_pcl_returns_owned_tensor(point_clouds, configs):
+
+    configs.precision = 'float64'
+    first = pcl.bev_from_pcl(point_clouds['float64'], configs)
+    first_values = first.clone()
+    second = pcl.bev_from_pcl(point_clouds['float64'][::2], configs)
+    assert first.data_ptr() != second.data_ptr()
+    assert torch.equal(first, first_values)
@@ -6,6 +6,7 @@
 
 import sys
 import math
+import collections
 
 import torch
 import torch.nn as nn
@@ -74,11 +75,11 @@ class Upsample_expand(nn.Module):
 
     def forward(self, x):
         stride = self.stride
-        assert (x.data.dim() == 4)
-        B = x.data.size(0)
-        C = x.data.size(1)
-        H = x.data.size(2)
-        W = x.data.size(3)
+        assert (x.dim() == 4)
+        B = x.size(0)
+        C = x.size(1)
+        H = x.size(2)
+        W = x.size(3)
         ws = stride
         hs = stride
         x = x.view(B, C, H, 1, W, 1).expand(B, C, H, stride, W, stride).contiguous().view(B, C, H * stride, W * stride)
@@ -109,11 +110,11 @@ class Reorg(nn.Module):
 
     def forward(self, x):
         stride = self.stride
-        assert (x.data.dim() == 4)
-        B = x.data.size(0)
-        C = x.data.size(1)
-        H = x.data.size(2)
-        W = x.data.size(3)
+        assert (x.dim() == 4)
+        B = x.size(0)
+        C = x.size(1)
+        H = x.size(2)
+        W = x.size(3)
         assert (H % stride == 0)
         assert (W % stride == 0)
         ws = stride
@@ -130,10 +131,10 @@ class GlobalAvgPool2d(nn.Module):
         super(GlobalAvgPool2d, self).__init__()
 
     def forward(self, x):
-        N = x.data.size(0)
-        C = x.data.size(1)
-        H = x.data.size(2)
-        W = x.data.size(3)
+        N = x.size(0)
+        C = x.size(1)
+        H = x.size(2)
+        W = x.size(3)
         x = F.avg_pool2d(x, (H, W))
         x = x.view(N, C)
         return x
@@ -148,6 +149,11 @@ class EmptyModule(nn.Module):
         return x
 
 
+# one layer of the compiled forward pass: the layer index, cfg block type, indices of the input layers, block
+# parameters, the layer outputs to release after this step and whether the output of this step is used later
+PlanStep = collections.namedtuple('PlanStep', ['index', 'type', 'inputs', 'params', 'release', 'keep'])
+
+
 # support route shortcut and reorg
 class Darknet(nn.Module):
     def __init__(self, cfgfile, use_giou_loss):
@@ -158,6 +164,7 @@ class Darknet(nn.Module):
         self.height = int(self.blocks[0]['height'])
 
         self.models = self.create_network(self.blocks)  # merge conv, bn,leaky
+        self.plan = self.compile_plan(self.blocks)
         self.yolo_layers = [layer for layer in self.models if layer.__class__.__name__ == 'YoloLayer']
 
         self.loss = self.models[len(self.models) - 1]
@@ -168,73 +175,85 @@ class Darknet(nn.Module):
     def forward(self, x, targets=None):
         # batch_size, c, h, w
         img_size = x.size(2)
-        ind = -2
         self.loss = None
-        outputs = dict()
+        outputs = {-1: x}  # outputs of the layers which are still needed, the network input has index -1
         loss = 0.
         yolo_outputs = []
-        for block in self.blocks:
-            ind = ind + 1
-            # if ind > 0:
-            #    return x
-
-            if block['type'] == 'net':
-                continue
-            elif block['type'] in ['convolutional', 'maxpool', 'reorg', 'upsample', 'avgpool', 'softmax', 'connected']:
-                x = self.models[ind](x)
-                outputs[ind] = x
-            elif block['type'] == 'route':
-                layers = block['layers'].split(',')
-                layers = [int(i) if int(i) > 0 else int(i) + ind for i in layers]
-                if len(layers) == 1:
-                    if 'groups' not in block.keys() or int(block['groups']) == 1:
-                        x = outputs[layers[0]]
-                        outputs[ind] = x
-                    else:
-                        groups = int(block['groups'])
-                        group_id = int(block['group_id'])
-                        _, b, _, _ = outputs[layers[0]].shape
-                        x = outputs[layers[0]][:, b // groups * group_id:b // groups * (group_id + 1)]
-                        outputs[ind] = x
-                elif len(layers) == 2:
-                    x1 = outputs[layers[0]]
-                    x2 = outputs[layers[1]]
-                    x = torch.cat((x1, x2), 1)
-                    outputs[ind] = x
-                elif len(layers) == 4:
-                    x1 = outputs[layers[0]]
-                    x2 = outputs[layers[1]]
-                    x3 = outputs[layers[2]]
-                    x4 = outputs[layers[3]]
-                    x = torch.cat((x1, x2, x3, x4), 1)
-                    outputs[ind] = x
+        for step in self.plan:
+            if step.type == 'route':
+                groups, group_id = step.params
+                if len(step.inputs) > 1:
+                    x = torch.cat([outputs[i] for i in step.inputs], 1)
+                elif groups == 1:
+                    x = outputs[step.inputs[0]]
                 else:
-                    print("rounte number > 2 ,is {}".format(len(layers)))
+                    _, b, _, _ = outputs[step.inputs[0]].shape
+                    x = outputs[step.inputs[0]][:, b // groups * group_id:b // groups * (group_id + 1)]
 
-            elif block['type'] == 'shortcut':
-                from_layer = int(block['from'])
-                activation = block['activation']
-                from_layer = from_layer if from_layer > 0 else from_layer + ind
-                x1 = outputs[from_layer]
-                x2 = outputs[ind - 1]
-                x = x1 + x2
-                if activation == 'leaky':
+            elif step.type == 'shortcut':
+                x = outputs[step.inputs[0]] + outputs[step.inputs[1]]
+                if step.params == 'leaky':
                     x = F.leaky_relu(x, 0.1, inplace=True)
-                elif activation == 'relu':
+                elif step.params == 'relu':
                     x = F.relu(x, inplace=True)
-                outputs[ind] = x
-            elif block['type'] == 'yolo':
-                x, layer_loss = self.models[ind](x, targets, img_size, self.use_giou_loss)
+
+            elif step.type == 'yolo':
+                x, layer_loss = self.models[step.index](outputs[step.inputs[0]], targets, img_size, self.use_giou_loss)
                 loss += layer_loss
                 yolo_outputs.append(x)
-            elif block['type'] == 'cost':
-                continue
+
             else:
-                print('unknown type %s' % (block['type']))
+                x = self.models[step.index](outputs[step.inputs[0]])
+
+            # free all outputs whose last consumer has run, keep the new one only if a later layer reads it
+            for i in step.release:
+                del outputs[i]
+            if step.keep:
+                outputs[step.index] = x
+
         yolo_outputs = to_cpu(torch.cat(yolo_outputs, 1))
 
         return yolo_outputs if targets is None else (loss, yolo_outputs)
 
+    def compile_plan(self, blocks):
+        """ Translate the cfg blocks into a static list of PlanSteps.
+
+        Route and shortcut layers get their input layer indices resolved once. A liveness analysis finds the last
+        step reading each layer output, so forward can release every activation as soon as it is no longer needed
+        instead of keeping all of them until the end of the pass.
+        """
+
+        plan = []
+        ind = -2
+        for block in blocks:
+            ind = ind + 1
+            if block['type'] in ['net', 'cost']:
+                continue
+            elif block['type'] in ['convolutional', 'maxpool', 'reorg', 'upsample', 'avgpool', 'softmax', 'connected', 'yolo']:
+                inputs, params = [ind - 1], None
+            elif block['type'] == 'route':
+                inputs = [int(i) if int(i) > 0 else int(i) + ind for i in block['layers'].split(',')]
+                if len(inputs) not in [1, 2, 4]:
+                    print("rounte number > 2 ,is {}".format(len(inputs)))
+                params = (int(block.get('groups', 1)), int(block.get('group_id', 0)))
+            elif block['type'] == 'shortcut':
+                from_layer = int(block['from'])
+                from_layer = from_layer if from_layer > 0 else from_layer + ind
+                inputs, params = [from_layer, ind - 1], block['activation']
+            else:
+                print('unknown type %s' % (block['type']))
+                continue
+            plan.append((ind, block['type'], inputs, params))
+
+        last_use = {}
+        for step_idx, (_, _, inputs, _) in enumerate(plan):
+            for i in inputs:
+                last_use[i] = step_idx
+
+        return [PlanStep(index, block_type, inputs, params,
+                         release=[i for i in set(inputs) if last_use[i] == step_idx], keep=(index in last_use))
+                for step_idx, (index, block_type, inputs, params) in enumerate(plan)]
+
     def print_network(self):
         print_cfg(self.blocks)
 
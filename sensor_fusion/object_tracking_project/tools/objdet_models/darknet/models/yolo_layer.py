@@ -27,7 +27,7 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 from utils.torch_utils import to_cpu
 from utils.iou_rotated_boxes_utils import iou_pred_vs_target_boxes, iou_rotated_boxes_targets_vs_anchors, \
-    get_polygons_areas_fix_xy
+    get_corners_areas_fix_xy
 
 
 class YoloLayer(nn.Module):
@@ -56,6 +56,9 @@ class YoloLayer(nn.Module):
         self.img_size = 0
         self.metrics = {}
 
+        # grid offsets and anchor sizes for inference, per (grid_size, img_size, device)
+        self.inference_grids = {}
+
     def compute_grid_offsets(self, grid_size):
         self.grid_size = grid_size
         g = self.grid_size
@@ -69,8 +72,37 @@ class YoloLayer(nn.Module):
         self.anchor_w = self.scaled_anchors[:, 0:1].view((1, self.num_anchors, 1, 1))
         self.anchor_h = self.scaled_anchors[:, 1:2].view((1, self.num_anchors, 1, 1))
 
-        # Pre compute polygons and areas of anchors
-        self.scaled_anchors_polygons, self.scaled_anchors_areas = get_polygons_areas_fix_xy(self.scaled_anchors)
+        # Pre compute corners and areas of anchors
+        self.scaled_anchors_conners, self.scaled_anchors_areas = get_corners_areas_fix_xy(self.scaled_anchors)
+
+    def get_inference_grids(self, grid_size, img_size, device):
+        key = (grid_size, img_size, device)
+        if key not in self.inference_grids:
+            stride = img_size / grid_size
+            grid_y, grid_x = torch.meshgrid(torch.arange(grid_size, device=device, dtype=torch.float),
+                                            torch.arange(grid_size, device=device, dtype=torch.float), indexing='ij')
+            grid_xy = torch.stack((grid_x, grid_y), dim=-1).view(1, 1, grid_size, grid_size, 2)
+            anchor_wh = torch.tensor([(a_w / stride, a_h / stride) for a_w, a_h, _, _ in self.anchors], device=device,
+                                     dtype=torch.float).view(1, self.num_anchors, 1, 1, 2)
+            self.inference_grids[key] = (grid_xy, anchor_wh, stride)
+        return self.inference_grids[key]
+
+    def forward_inference(self, x, img_size=608):
+        """ Decode the predicted boxes without any of the training state, see forward for the output format """
+        num_samples, _, _, grid_size = x.size()
+        grid_xy, anchor_wh, stride = self.get_inference_grids(grid_size, img_size, x.device)
+
+        # prediction size: [num_samples, num_anchors, grid_size, grid_size, num_classes + 7]
+        prediction = x.view(num_samples, self.num_anchors, self.num_classes + 7, grid_size, grid_size).permute(0, 1, 3, 4, 2)
+        output = torch.cat((
+            (torch.sigmoid(prediction[..., 0:2]) + grid_xy) * stride,
+            torch.exp(prediction[..., 2:4]).clamp(max=1E3) * anchor_wh * stride,
+            prediction[..., 4:6],
+            torch.sigmoid(prediction[..., 6:]),
+        ), dim=-1)
+
+        # output size: [num_samples, num boxes, 7 + num_classes]
+        return output.view(num_samples, -1, self.num_classes + 7)
 
     def build_targets(self, pred_boxes, pred_cls, target, anchors):
         """ Built yolo targets to compute loss
@@ -106,10 +138,10 @@ class YoloLayer(nn.Module):
             gwh = target_boxes[:, 2:4]
             gimre = target_boxes[:, 4:6]
 
-            targets_polygons, targets_areas = get_polygons_areas_fix_xy(target_boxes[:, 2:6])
+            targets_conners, targets_areas = get_corners_areas_fix_xy(target_boxes[:, 2:6])
             # Get anchors with best iou
-            ious = iou_rotated_boxes_targets_vs_anchors(self.scaled_anchors_polygons, self.scaled_anchors_areas,
-                                                        targets_polygons, targets_areas)
+            ious = iou_rotated_boxes_targets_vs_anchors(self.scaled_anchors_conners, self.scaled_anchors_areas,
+                                                        targets_conners, targets_areas)
             best_ious, best_n = ious.max(0)
 
             gx, gy = gxy.t()
@@ -121,8 +153,8 @@ class YoloLayer(nn.Module):
             noobj_mask[b, best_n, gj, gi] = 0
 
             # Set noobj mask to zero where iou exceeds ignore threshold
-            for i, anchor_ious in enumerate(ious.t()):
-                noobj_mask[b[i], anchor_ious > self.ignore_thresh, gj[i], gi[i]] = 0
+            target_idx, anchor_idx = (ious.t() > self.ignore_thresh).nonzero(as_tuple=True)
+            noobj_mask[b[target_idx], anchor_idx, gj[target_idx], gi[target_idx]] = 0
 
             # Coordinates
             tx[b, best_n, gj, gi] = gx - gx.floor()
@@ -154,6 +186,9 @@ class YoloLayer(nn.Module):
         :param img_size: default 608
         :return:
         """
+        if targets is None and not self.training:
+            return self.forward_inference(x, img_size), 0
+
         self.img_size = img_size
         self.use_giou_loss = use_giou_loss
         self.device = x.device
@@ -96,6 +96,108 @@ def PolyArea2D(pts):
     return area
 
 
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _counter_clockwise(rects):
+    # reverse the vertex order of all rectangles with a negative signed area
+    signed_areas = _cross(rects, torch.roll(rects, -1, dims=1)).sum(dim=1)
+    return torch.where((signed_areas < 0)[:, None, None], rects.flip(1), rects)
+
+
+def intersection_area_batch(rects1, rects2, eps=1e-9):
+    """Calculate the intersection areas of pairs of rectangles, differentiable with respect to the vertices
+
+    Args:
+        rects1: vertices of the rectangles (num_pairs, 4, 2)
+        rects2: vertices of the rectangles (num_pairs, 4, 2)
+
+    Returns:
+        intersection areas (num_pairs,)
+
+    The intersection polygon is spanned by the vertices of each rectangle which lie inside the other one and by the
+    crossings of their edges. Its vertices are ordered by their angle around the centroid, the area then follows
+    from the shoelace formula. Computed in double precision, the inside tests would be unreliable in float.
+    """
+    dtype = rects1.dtype
+    rects1 = _counter_clockwise(rects1.double())
+    rects2 = _counter_clockwise(rects2.double())
+    edges1 = torch.roll(rects1, -1, dims=1) - rects1
+    edges2 = torch.roll(rects2, -1, dims=1) - rects2
+
+    # vertices inside the other rectangle lie on the left of all of its edges, (num_pairs, 4 vertices, 4 edges)
+    inside1 = (_cross(edges2[:, None], rects1[:, :, None] - rects2[:, None]) >= -eps).all(dim=2)
+    inside2 = (_cross(edges1[:, None], rects2[:, :, None] - rects1[:, None]) >= -eps).all(dim=2)
+
+    # crossings of edge i of rectangle 1 (p + t * r) with edge j of rectangle 2 (q + u * s), (num_pairs, 4, 4)
+    p, r = rects1[:, :, None], edges1[:, :, None]
+    q, s = rects2[:, None], edges2[:, None]
+    denom = _cross(r, s)
+    parallel = denom.abs() < eps
+    denom = torch.where(parallel, torch.ones_like(denom), denom)
+    t = _cross(q - p, s) / denom
+    u = _cross(q - p, r) / denom
+    crossing = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    crossing_points = p + t[..., None] * r
+
+    num_pairs = rects1.size(0)
+    points = torch.cat((rects1, rects2, crossing_points.reshape(num_pairs, 16, 2)), dim=1)
+    valid = torch.cat((inside1, inside2, crossing.reshape(num_pairs, 16)), dim=1)
+    num_valid = valid.sum(dim=1)
+
+    # sort the valid points by angle, invalid points go to the end and are replaced by the last valid point,
+    # so that they add zero area; the ordering itself needs no gradient
+    with torch.no_grad():
+        centroid = (points * valid[..., None]).sum(dim=1) / num_valid.clamp(min=1)[:, None]
+        angles = torch.atan2(points[..., 1] - centroid[:, None, 1], points[..., 0] - centroid[:, None, 0])
+        order = torch.where(valid, angles, torch.full_like(angles, float('inf'))).argsort(dim=1)
+        last_valid = torch.minimum(torch.arange(24, device=points.device), num_valid.clamp(min=1)[:, None] - 1)
+        order = torch.gather(order, 1, last_valid)
+    polygons = torch.gather(points, 1, order[..., None].expand(-1, -1, 2))
+
+    areas = _cross(polygons, torch.roll(polygons, -1, dims=1)).sum(dim=1).abs() * 0.5
+    return torch.where(num_valid >= 3, areas, torch.zeros_like(areas)).to(dtype)
+
+
+def convex_hull_area_batch(pts, eps=1e-9):
+    """Calculate the areas of the convex hulls of point sets, differentiable with respect to the points
+
+    Args:
+        pts: points (num_sets, num_points, 2)
+
+    Returns:
+        convex hull areas (num_sets,)
+
+    The directed segment from point i to point j is a counter-clockwise hull edge if no point lies on its right and
+    no collinear point lies beyond its ends. Duplicated points are only considered once.
+    """
+    dtype = pts.dtype
+    pts = pts.double()
+    num_points = pts.size(1)
+
+    # duplicate[k]: point k coincides with a point of lower index
+    dists = (pts[:, :, None] - pts[:, None]).abs().amax(dim=-1)
+    lower = torch.ones(num_points, num_points, dtype=torch.bool, device=pts.device).tril(-1)
+    duplicate = ((dists < eps) & lower).any(dim=2)
+
+    # position of all points k relative to the segments i -> j, (num_sets, i, j, k)
+    seg = pts[:, None, :, :] - pts[:, :, None, :]
+    rel = pts[:, None, None, :, :] - pts[:, :, None, None, :]
+    side = _cross(seg[:, :, :, None], rel)
+    seg_len2 = (seg ** 2).sum(-1)
+    proj = (seg[:, :, :, None] * rel).sum(-1) / seg_len2.clamp(min=eps)[..., None]
+
+    with torch.no_grad():
+        ignored = duplicate[:, None, None, :]
+        left = (side > eps) | ((side.abs() <= eps) & (proj >= 0) & (proj <= 1)) | ignored
+        is_edge = left.all(dim=3) & (seg_len2 > eps) & ~duplicate[:, :, None] & ~duplicate[:, None, :]
+
+    edge_cross = _cross(pts[:, :, None], pts[:, None])
+    areas = (edge_cross * is_edge).sum(dim=(1, 2)) * 0.5
+    return areas.to(dtype)
+
+
 if __name__ == "__main__":
     import cv2
     import numpy as np
@@ -4,59 +4,8 @@ import tqdm
 
 import torch
 import numpy as np
-from shapely.geometry import Polygon
 
-# bev image coordinates format
-def get_corners(x, y, w, l, yaw):
-    bev_corners = np.zeros((4, 2), dtype=np.float32)
-    cos_yaw = np.cos(yaw)
-    sin_yaw = np.sin(yaw)
-    # front left
-    bev_corners[0, 0] = x - w / 2 * cos_yaw - l / 2 * sin_yaw
-    bev_corners[0, 1] = y - w / 2 * sin_yaw + l / 2 * cos_yaw
-
-    # rear left
-    bev_corners[1, 0] = x - w / 2 * cos_yaw + l / 2 * sin_yaw
-    bev_corners[1, 1] = y - w / 2 * sin_yaw - l / 2 * cos_yaw
-
-    # rear right
-    bev_corners[2, 0] = x + w / 2 * cos_yaw + l / 2 * sin_yaw
-    bev_corners[2, 1] = y + w / 2 * sin_yaw - l / 2 * cos_yaw
-
-    # front right
-    bev_corners[3, 0] = x + w / 2 * cos_yaw - l / 2 * sin_yaw
-    bev_corners[3, 1] = y + w / 2 * sin_yaw + l / 2 * cos_yaw
-
-    return bev_corners
-    
-
-def cvt_box_2_polygon(box):
-    """
-    :param box: an array of shape [4, 2]
-    :return: a shapely.geometry.Polygon object
-    """
-    # use .buffer(0) to fix a line polygon
-    # more infor: https://stackoverflow.com/questions/13062334/polygon-intersection-error-in-shapely-shapely-geos-topologicalerror-the-opera
-    return Polygon([(box[i, 0], box[i, 1]) for i in range(len(box))]).buffer(0)
-
-
-def compute_iou_nms(idx_self, idx_other, polygons, areas):
-    """Calculates IoU of the given box with the array of the given boxes.
-    box: a polygon
-    boxes: a vector of polygons
-    Note: the areas are passed in rather than calculated here for
-    efficiency. Calculate once in the caller to avoid duplicate work.
-    """
-    # Calculate intersection areas
-    ious = []
-    box1 = polygons[idx_self]
-    for idx in idx_other:
-        box2 = polygons[idx]
-        intersection = box1.intersection(box2).area
-        iou = intersection / (areas[idx] + areas[idx_self] - intersection + 1e-12)
-        ious.append(iou)
-
-    return np.array(ious, dtype=np.float32)
+from .cal_intersection_rotated_boxes import intersection_area_batch
 
 
 def load_classes(path):
@@ -216,25 +165,46 @@ def iou_rotated_single_vs_multi_boxes_cpu(single_box, multi_boxes):
     :return:
     """
 
-    s_x, s_y, s_w, s_l, s_im, s_re = single_box
-    s_area = s_w * s_l
-    s_yaw = np.arctan2(s_im, s_re)
-    s_conners = get_corners(s_x, s_y, s_w, s_l, s_yaw)
-    s_polygon = cvt_box_2_polygon(s_conners)
+    ious = iou_rotated_boxes_matrix_cpu(np.asarray(single_box).reshape(1, 6), np.asarray(multi_boxes))[0]
 
-    m_x, m_y, m_w, m_l, m_im, m_re = multi_boxes.transpose(1, 0)
-    targets_areas = m_w * m_l
-    m_yaw = np.arctan2(m_im, m_re)
-    m_boxes_conners = get_corners_vectorize(m_x, m_y, m_w, m_l, m_yaw)
-    m_boxes_polygons = [cvt_box_2_polygon(box_) for box_ in m_boxes_conners]
+    return torch.from_numpy(ious).float()
 
-    ious = []
-    for m_idx in range(multi_boxes.shape[0]):
-        intersection = s_polygon.intersection(m_boxes_polygons[m_idx]).area
-        iou_ = intersection / (s_area + targets_areas[m_idx] - intersection + 1e-16)
-        ious.append(iou_)
 
-    return torch.tensor(ious, dtype=torch.float)
+def iou_rotated_boxes_matrix_cpu(boxes1, boxes2, max_pairs_per_chunk=100000):
+    """IoU of all pairs of rotated boxes
+
+    :param boxes1: Numpy array [num_boxes1, 6], (x, y, w, l, im, re)
+    :param boxes2: Numpy array [num_boxes2, 6]
+    :return: Numpy array [num_boxes1, num_boxes2], float32
+
+    Only pairs whose circumscribed circles overlap are intersected, all other pairs have zero IoU.
+    """
+    ious = np.zeros((boxes1.shape[0], boxes2.shape[0]), dtype=np.float32)
+    if ious.size == 0:
+        return ious
+
+    corners, areas, radii = [], [], []
+    for boxes in (boxes1, boxes2):
+        x, y, w, l, im, re = boxes.transpose(1, 0)
+        corners.append(get_corners_vectorize(x, y, w, l, np.arctan2(im, re)))
+        areas.append(w * l)
+        radii.append(np.sqrt(w ** 2 + l ** 2) / 2)
+
+    # the center distances and the candidate points of the pairs take some memory, so boxes1 is split into blocks of rows
+    # with at most max_pairs_per_chunk pairs, of which only the pairs passing the circle test are kept
+    rows_per_block = max(1, max_pairs_per_chunk // boxes2.shape[0])
+    for row_start in range(0, boxes1.shape[0], rows_per_block):
+        rows = slice(row_start, row_start + rows_per_block)
+        center_dists = np.hypot(boxes1[rows, None, 0] - boxes2[None, :, 0], boxes1[rows, None, 1] - boxes2[None, :, 1])
+        idx1, idx2 = np.nonzero(center_dists < radii[0][rows, None] + radii[1][None, :])
+        idx1 += row_start
+        if len(idx1) == 0:
+            continue
+        intersection = intersection_area_batch(torch.from_numpy(corners[0][idx1]).double(),
+                                               torch.from_numpy(corners[1][idx2]).double()).numpy()
+        ious[idx1, idx2] = intersection / (areas[0][idx1] + areas[1][idx2] - intersection + 1e-16)
+
+    return ious
 
 
 def get_corners_vectorize(x, y, w, l, yaw):
@@ -277,18 +247,13 @@ def nms_cpu(boxes, confs, nms_thresh=0.5):
     # order of reduce confidence (high --> low)
     order = confs.argsort()[::-1]
 
-    x, y, w, l, im, re = boxes.transpose(1, 0)
-    yaw = np.arctan2(im, re)
-    boxes_conners = get_corners_vectorize(x, y, w, l, yaw)
-    boxes_polygons = [cvt_box_2_polygon(box_) for box_ in boxes_conners]  # 4 vertices of the box
-    boxes_areas = w * l
-
     keep = []
     while order.size > 0:
         idx_self = order[0]
         idx_other = order[1:]
         keep.append(idx_self)
-        over = compute_iou_nms(idx_self, idx_other, boxes_polygons, boxes_areas)
+        # overlaps of the kept box with the remaining boxes only, memory stays linear in the number of boxes
+        over = iou_rotated_boxes_matrix_cpu(boxes[idx_self:idx_self + 1], boxes[idx_other])[0]
         inds = np.where(over <= nms_thresh)[0]
         order = order[inds + 1]
 
@@ -357,19 +322,25 @@ def post_processing_v2(prediction, conf_thresh=0.95, nms_thresh=0.4):
         image_pred = image_pred[(-score).argsort()]
         class_confs, class_preds = image_pred[:, 7:].max(dim=1, keepdim=True)
         detections = torch.cat((image_pred[:, :7].float(), class_confs.float(), class_preds.float()), dim=1)
-        # Perform non-maximum suppression
+        # Perform non-maximum suppression, the overlaps of each kept box are only computed against the remaining boxes
+        boxes = detections[:, :6].numpy()
+        remaining = torch.ones(detections.size(0), dtype=torch.bool)
         keep_boxes = []
-        while detections.size(0):
-            # large_overlap = rotated_bbox_iou(detections[0, :6].unsqueeze(0), detections[:, :6], 1.0, False) > nms_thres # not working
-            large_overlap = iou_rotated_single_vs_multi_boxes_cpu(detections[0, :6], detections[:, :6]) > nms_thresh
-            label_match = detections[0, -1] == detections[:, -1]
+        while remaining.any():
+            remaining_inds = remaining.nonzero()[:, 0]
+            first = int(remaining_inds[0])
             # Indices of boxes with lower confidence scores, large IOUs and matching labels
-            invalid = large_overlap & label_match
+            large_overlap = torch.from_numpy(iou_rotated_boxes_matrix_cpu(boxes[first:first + 1], boxes[remaining_inds.numpy()])[0] > nms_thresh)
+            label_match = detections[remaining_inds, -1] == detections[first, -1]
+            invalid = torch.zeros_like(remaining)
+            invalid[remaining_inds[large_overlap & label_match]] = True
+            invalid[first] = True
             weights = detections[invalid, 6:7]
             # Merge overlapping bboxes by order of confidence
-            detections[0, :6] = (weights * detections[invalid, :6]).sum(0) / weights.sum()
-            keep_boxes += [detections[0]]
-            detections = detections[~invalid]
+            kept_box = detections[first].clone()
+            kept_box[:6] = (weights * detections[invalid, :6]).sum(0) / weights.sum()
+            keep_boxes += [kept_box]
+            remaining &= ~invalid
         if len(keep_boxes) > 0:
             output[image_i] = torch.stack(keep_boxes)
 
@@ -18,7 +18,7 @@ from scipy.spatial import ConvexHull
 
 sys.path.append('../')
 
-from utils.cal_intersection_rotated_boxes import intersection_area, PolyArea2D
+from utils.cal_intersection_rotated_boxes import intersection_area, PolyArea2D, intersection_area_batch, convex_hull_area_batch
 
 
 def cvt_box_2_polygon(box):
@@ -61,7 +61,7 @@ def get_corners_vectorize(x, y, w, l, yaw):
     return bbox2
 
 
-def get_polygons_areas_fix_xy(boxes, fix_xy=100.):
+def get_corners_areas_fix_xy(boxes, fix_xy=100.):
     """
     Args:
         box: (num_boxes, 4) --> w, l, im, re
@@ -73,32 +73,28 @@ def get_polygons_areas_fix_xy(boxes, fix_xy=100.):
     w, l, im, re = boxes.t()
     yaw = torch.atan2(im, re)
     boxes_conners = get_corners_vectorize(x, y, w, l, yaw)
-    boxes_polygons = [cvt_box_2_polygon(box_) for box_ in boxes_conners]
     boxes_areas = w * l
 
-    return boxes_polygons, boxes_areas
+    return boxes_conners, boxes_areas
 
 
-def iou_rotated_boxes_targets_vs_anchors(anchors_polygons, anchors_areas, targets_polygons, targets_areas):
-    device = anchors_areas.device
+def iou_rotated_boxes_targets_vs_anchors(anchors_conners, anchors_areas, targets_conners, targets_areas):
     num_anchors = len(anchors_areas)
     num_targets_boxes = len(targets_areas)
 
-    ious = torch.zeros(size=(num_anchors, num_targets_boxes), device=device, dtype=torch.float)
-
-    for a_idx in range(num_anchors):
-        for tg_idx in range(num_targets_boxes):
-            intersection = anchors_polygons[a_idx].intersection(targets_polygons[tg_idx]).area
-            iou = intersection / (anchors_areas[a_idx] + targets_areas[tg_idx] - intersection + 1e-16)
-            ious[a_idx, tg_idx] = iou
+    # intersect all (anchor, target) pairs at once
+    intersections = intersection_area_batch(
+        anchors_conners[:, None].expand(-1, num_targets_boxes, -1, -1).reshape(-1, 4, 2),
+        targets_conners[None].expand(num_anchors, -1, -1, -1).reshape(-1, 4, 2)).view(num_anchors, num_targets_boxes)
+    ious = intersections / (anchors_areas[:, None] + targets_areas[None, :] - intersections + 1e-16)
 
     return ious
 
 
 def iou_pred_vs_target_boxes(pred_boxes, target_boxes, GIoU=False, DIoU=False, CIoU=False):
     assert pred_boxes.size() == target_boxes.size(), "Unmatch size of pred_boxes and target_boxes"
-    device = pred_boxes.device
-    n_boxes = pred_boxes.size(0)
+    if DIoU or CIoU:
+        raise NotImplementedError
 
     t_x, t_y, t_w, t_l, t_im, t_re = target_boxes.t()
     t_yaw = torch.atan2(t_im, t_re)
@@ -110,36 +106,18 @@ def iou_pred_vs_target_boxes(pred_boxes, target_boxes, GIoU=False, DIoU=False, C
     p_conners = get_corners_vectorize(p_x, p_y, p_w, p_l, p_yaw)
     p_areas = p_w * p_l
 
-    ious = []
-    giou_loss = torch.tensor([0.], device=device, dtype=torch.float)
-    # Thinking to apply vectorization this step
-    for box_idx in range(n_boxes):
-        p_cons, t_cons = p_conners[box_idx], t_conners[box_idx]
-        if not GIoU:
-            p_poly, t_poly = cvt_box_2_polygon(p_cons), cvt_box_2_polygon(t_cons)
-            intersection = p_poly.intersection(t_poly).area
-        else:
-            intersection = intersection_area(p_cons, t_cons)
-
-        p_area, t_area = p_areas[box_idx], t_areas[box_idx]
-        union = p_area + t_area - intersection
-        iou = intersection / (union + 1e-16)
-
-        if GIoU:
-            convex_conners = torch.cat((p_cons, t_cons), dim=0)
-            hull = ConvexHull(convex_conners.clone().detach().cpu().numpy())  # done on cpu, just need indices output
-            convex_conners = convex_conners[hull.vertices]
-            convex_area = PolyArea2D(convex_conners)
-            giou_loss += 1. - (iou - (convex_area - union) / (convex_area + 1e-16))
-        else:
-            giou_loss += 1. - iou
-
-        if DIoU or CIoU:
-            raise NotImplementedError
-
-        ious.append(iou)
-
-    return torch.tensor(ious, device=device, dtype=torch.float), giou_loss
+    # all pairs are computed at once and stay differentiable with respect to the predicted boxes
+    intersections = intersection_area_batch(p_conners, t_conners)
+    unions = p_areas + t_areas - intersections
+    ious = intersections / (unions + 1e-16)
+
+    if GIoU:
+        convex_areas = convex_hull_area_batch(torch.cat((p_conners, t_conners), dim=1))
+        giou_loss = (1. - (ious - (convex_areas - unions) / (convex_areas + 1e-16))).sum().view(1)
+    else:
+        giou_loss = (1. - ious).sum().view(1)
+
+    return ious.detach(), giou_loss
 
 
 if __name__ == "__main__":
@@ -104,6 +104,57 @@ def decode(hm_cen, cen_offset, direction, z_coor, dim, K=40):
     return detections
 
 
+def decode_sparse(hm_cen, cen_offset, direction, z_coor, dim, K=40, conf_thresh=0.):
+    """Decode only the heatmap peaks with a score above conf_thresh, at most the K best ones per sample
+
+    :return: list of [num_peaks, 10] tensors, one per sample, in the format of decode and sorted by descending score
+    # (scores-0:1, xs-1:2, ys-2:3, z_coor-3:4, dim-4:7, direction-7:9, clses-9:10)
+    The heatmap is thresholded first, so the 3x3 peak test of _nms only runs on the remaining candidates and all
+    heads are gathered at the surviving peaks only.
+    """
+    batch_size, num_classes, height, width = hm_cen.size()
+
+    # a candidate is a peak if no value in its 3x3 neighborhood is larger, like in _nms
+    candidates = hm_cen > conf_thresh
+    if 9 * int(candidates.sum()) < hm_cen.numel():
+        batch_inds, clses, ys, xs = torch.nonzero(candidates, as_tuple=True)
+        scores = hm_cen[batch_inds, clses, ys, xs]
+        padded = F.pad(hm_cen, (1, 1, 1, 1), value=float('-inf'))
+        neighbors = torch.stack([padded[batch_inds, clses, ys + dy, xs + dx] for dy in range(3) for dx in range(3)])
+        is_peak = scores >= neighbors.max(dim=0)[0]
+        batch_inds, clses, ys, xs, scores = batch_inds[is_peak], clses[is_peak], ys[is_peak], xs[is_peak], scores[is_peak]
+    else:
+        # with this many candidates, pooling the whole heatmap is cheaper
+        hm_cen = _nms(hm_cen)
+        batch_inds, clses, ys, xs = torch.nonzero(hm_cen > conf_thresh, as_tuple=True)
+        scores = hm_cen[batch_inds, clses, ys, xs]
+
+    detections = []
+    for i in range(batch_size):
+        # top-k is only needed if there are more than K peaks
+        inds = torch.nonzero(batch_inds == i).squeeze(1)
+        if inds.numel() > K:
+            sample_scores, order = torch.topk(scores[inds], K)
+        else:
+            sample_scores, order = scores[inds].sort(descending=True)
+        inds = inds[order]
+        sample_ys, sample_xs = ys[inds], xs[inds]
+
+        if cen_offset is not None:
+            offsets = cen_offset[i, :, sample_ys, sample_xs].t()
+            peak_xs = sample_xs.float() + offsets[:, 0]
+            peak_ys = sample_ys.float() + offsets[:, 1]
+        else:
+            peak_xs = sample_xs.float() + 0.5
+            peak_ys = sample_ys.float() + 0.5
+
+        detections.append(torch.cat([sample_scores[:, None], peak_xs[:, None], peak_ys[:, None],
+                                     z_coor[i, :, sample_ys, sample_xs].t(), dim[i, :, sample_ys, sample_xs].t(),
+                                     direction[i, :, sample_ys, sample_xs].t(), clses[inds, None].float()], dim=1))
+
+    return detections
+
+
 def get_yaw(direction):
     return np.arctan2(direction[:, 0:1], direction[:, 1:2])
 
@@ -138,3 +189,28 @@ def post_processing(detections, configs):
         ret.append(top_preds)
 
     return ret
+
+
+def post_processing_array(detections, configs):
+    """
+    :param detections: [batch_size, K, 10], or a list of [num_detections, 10] arrays as returned by decode_sparse
+    # (scores x 1, xs x 1, ys x 1, z_coor x 1, dim x 3, direction x 2, clses x 1)
+    :return: list of [num_detections, 9] float32 arrays, one per sample
+    # (score, x, y, z, h, w, l, yaw, cls), ordered by class like the dict returned by post_processing
+    """
+    ret = []
+    for sample in detections:
+        keep_inds = (sample[:, 0] > configs.conf_thresh) & (sample[:, -1] < configs.num_classes)
+        sample = sample[keep_inds][np.argsort(sample[keep_inds, -1], kind='stable')]
+
+        top_preds = np.empty((len(sample), 9), dtype=np.float32)
+        top_preds[:, 0] = sample[:, 0]
+        top_preds[:, 1:3] = sample[:, 1:3] * configs.down_ratio
+        top_preds[:, 3:5] = sample[:, 3:5]
+        top_preds[:, 5] = sample[:, 5] / (configs.lim_y[1] - configs.lim_y[0]) * configs.bev_width
+        top_preds[:, 6] = sample[:, 6] / (configs.lim_x[1] - configs.lim_x[0]) * configs.bev_height
+        top_preds[:, 7] = np.arctan2(sample[:, 7], sample[:, 8])
+        top_preds[:, 8] = sample[:, 9]
+        ret.append(top_preds)
+
+    return ret
@@ -13,54 +13,243 @@
 # limitations under the License.
 # ==============================================================================
 
+import os
+import mmap
 import struct
 from . import dataset_pb2
+from .wire_format import find_varint_field, to_signed64, project_message
+
+# field number of Frame.timestamp_micros in dataset.proto
+FRAME_TIMESTAMP_FIELD = 2
+
+class RecordIndex:
+    """ Offsets, lengths and timestamps of all frame records in a file.
+
+        The index is built with a single sequential pass over the file (frames are not parsed, only the
+        timestamp field is extracted from the wire format) and can be persisted as a sidecar file so that
+        it only has to be built once per segment.
+    """
+
+    MAGIC = b'WODIDX01'
+    HEADER = struct.Struct("<8sQQ") # magic, size of the indexed file in bytes, number of records
+    ENTRY = struct.Struct("<QQq") # record offset, payload length, timestamp_micros
+
+    def __init__(self, offsets, lengths, timestamps, file_size):
+        self.offsets = offsets
+        self.lengths = lengths
+        self.timestamps = timestamps
+        self.file_size = file_size
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, file):
+        """ Scan an open tfrecord file from the beginning and index all records. """
+
+        offsets, lengths, timestamps = [], [], []
+
+        file.seek(0,0)
+        while True:
+            offset = file.tell()
+            header = file.read(12)
+            if len(header) < 12:
+                break
+
+            length, lengthcrc = struct.unpack("QI", header)
+            data = file.read(length)
+            file.seek(4,1) # skip data crc
+
+            offsets.append(offset)
+            lengths.append(length)
+            timestamps.append(to_signed64(find_varint_field(data, FRAME_TIMESTAMP_FIELD)))
+
+        return cls(offsets, lengths, timestamps, file.tell())
+
+    @classmethod
+    def build_from_buffer(cls, buffer):
+        """ Index all records of a tfrecord file mapped into memory, without copying any record data. """
+
+        offsets, lengths, timestamps = [], [], []
+
+        offset = 0
+        while offset + 12 <= len(buffer):
+            length, lengthcrc = struct.unpack_from("QI", buffer, offset)
+            data_start = offset + 12
+
+            offsets.append(offset)
+            lengths.append(length)
+            timestamps.append(to_signed64(find_varint_field(buffer, FRAME_TIMESTAMP_FIELD, data_start, data_start + length)))
+
+            offset = data_start + length + 4
+
+        return cls(offsets, lengths, timestamps, len(buffer))
+
+    @classmethod
+    def load(cls, filename, file_size):
+        """ Load an index from a sidecar file. Returns None if it is missing, corrupt or out of date. """
+
+        try:
+            with open(filename, "rb") as f:
+                magic, indexed_size, count = cls.HEADER.unpack(f.read(cls.HEADER.size))
+                if magic != cls.MAGIC or indexed_size != file_size:
+                    return None
+                entries = f.read(count * cls.ENTRY.size)
+        except (OSError, struct.error):
+            return None
+
+        if len(entries) != count * cls.ENTRY.size:
+            return None
+
+        offsets, lengths, timestamps = [], [], []
+        for offset, length, timestamp in cls.ENTRY.iter_unpack(entries):
+            offsets.append(offset)
+            lengths.append(length)
+            timestamps.append(timestamp)
+
+        return cls(offsets, lengths, timestamps, indexed_size)
+
+    def save(self, filename):
+        """ Write the index to a sidecar file. Returns False if the file could not be written. """
+
+        try:
+            with open(filename, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.file_size, len(self)))
+                for entry in zip(self.offsets, self.lengths, self.timestamps):
+                    f.write(self.ENTRY.pack(*entry))
+        except OSError:
+            return False
+
+        return True
+
+def parse_frame(data, fields=None):
+    """ Parse a serialized frame from any bytes-like object (bytes, memoryview, mmap slice).
+
+    fields: Optional projection of the frame, e.g. {'lasers': [dataset_pb2.LaserName.TOP], 'laser_labels': None}.
+            Only the listed fields are decoded, all other parts of the record are skipped without being parsed.
+            See wire_format.project_message() for the format.
+    """
+
+    if fields is not None:
+        data = project_message(data, dataset_pb2.Frame.DESCRIPTOR, fields)
+
+    frame = dataset_pb2.Frame()
+    try:
+        frame.ParseFromString(data)
+    except TypeError:
+        # some protobuf implementations only accept bytes
+        frame.ParseFromString(bytes(data))
+    return frame
 
 class WaymoDataFileReader:
-    def __init__(self, filename):
+    def __init__(self, filename, use_index=True, index_filename=None, use_mmap=False):
+        """ Open a Waymo Open Dataset tfrecord file.
+
+        use_index: If set, the record index is persisted next to the data file (or at index_filename) and
+                   reused by subsequent readers of the same file.
+        use_mmap: If set, the file is memory-mapped and records are handed to the parser as memoryview slices
+                  of the mapping instead of being read into intermediate bytes objects. Pages are loaded and
+                  shared by the OS, so several readers of the same file do not duplicate its contents.
+        """
+
+        self.filename = filename
         self.file = open(filename, "rb")
+        self.use_index = use_index
+        self.index_filename = index_filename if index_filename is not None else filename + ".idx"
+        self._index = None
 
-    def get_record_table(self):
-        """ Generate and return a table of the offset of all frame records in the file.
+        self.use_mmap = use_mmap
+        self._map = None
+        self._buffer = None
+        self._position = 0
+        if use_mmap:
+            self._map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buffer = memoryview(self._map)
 
-            This is particularly useful to determine the number of frames in the file
-            and access random frames rather than read the file sequentially.
+    def close(self):
+        """ Release the memory mapping (if any) and close the file.
+
+        Buffers returned by read_record_buffer() of a memory-mapped reader keep the mapping alive; they have to be
+        released (or deleted) first, otherwise mmap raises a BufferError.
         """
 
-        self.file.seek(0,0)
+        if self._buffer is not None:
+            self._buffer.release()
+            self._map.close()
+            self._buffer = None
+            self._map = None
+        self.file.close()
 
-        table = []
+    def __enter__(self):
+        return self
 
-        while self.file:
-            offset = self.file.tell()
+    def __exit__(self, *args):
+        self.close()
 
-            try:
-                self.read_record(header_only=True)
-                table.append(offset)
-            except StopIteration:
-                break
+    @property
+    def index(self):
+        """ The RecordIndex of this file, loaded from the sidecar file or built on first access. """
+
+        if self._index is None:
+            file_size = os.fstat(self.file.fileno()).st_size
+
+            if self.use_index:
+                self._index = RecordIndex.load(self.index_filename, file_size)
+
+            if self._index is None:
+                if self._buffer is not None:
+                    self._index = RecordIndex.build_from_buffer(self._buffer)
+                else:
+                    position = self.file.tell()
+                    self._index = RecordIndex.build(self.file)
+                    self.file.seek(position,0)
+
+                if self.use_index:
+                    self._index.save(self.index_filename)
 
-        self.file.seek(0,0)
+        return self._index
+
+    @property
+    def timestamps(self):
+        """ The timestamp_micros of every frame in the file. """
+
+        return self.index.timestamps
+
+    def get_record_table(self):
+        """ Return a table of the offset of all frame records in the file.
+
+            This is particularly useful to determine the number of frames in the file
+            and access random frames rather than read the file sequentially.
+            The table is served from the record index, so the file is only scanned once.
+        """
+
+        return list(self.index.offsets)
 
-        return table
-    
     def seek(self, offset):
         """ Seek to a specific frame record by offset.
 
         The offset of each frame in the file can be obtained with the function reader.get_record_table()
         """
 
-        self.file.seek(offset,0)
+        if self._buffer is not None:
+            self._position = offset
+        else:
+            self.file.seek(offset,0)
 
-    def read_record(self, header_only = False):
+    def read_record(self, header_only = False, fields = None):
         """ Read the current frame record in the file.
 
         If repeatedly called, it will return sequential records until the end of file. When the end is reached, it will raise a StopIteration exception.
         To reset to the first frame, call reader.seek(0)
+
+        fields: Only decode the given fields of the frame, see parse_frame().
         """
         
         # TODO: Check CRCs.
 
+        if self._buffer is not None:
+            return self._read_mapped_record(header_only, fields)
+
         header = self.file.read(12)
 
         if header == b'':
@@ -77,12 +266,89 @@ class WaymoDataFileReader:
             data = self.file.read(length)
             datacrc = struct.unpack("I",self.file.read(4))
 
-            frame = dataset_pb2.Frame()
-            frame.ParseFromString(data)
-            return frame
+            return parse_frame(data, fields)
+
+    def _read_mapped_record(self, header_only, fields):
+        """ read_record() for memory-mapped files: advances the reader position without copying data. """
+
+        if self._position + 12 > len(self._buffer):
+            raise StopIteration()
+
+        length, lengthcrc = struct.unpack_from("QI", self._buffer, self._position)
+        data_start = self._position + 12
+        self._position = data_start + length + 4
+
+        if header_only:
+            return None
+
+        return parse_frame(self._buffer[data_start:data_start + length], fields)
+
+    def read_record_buffer(self, index):
+        """ Return the raw serialized frame with the given index.
+
+        For memory-mapped readers this is a zero-copy memoryview into the mapping, otherwise a bytes object.
+        Neither moves the position used by the sequential iterator.
+        """
+
+        offset = self.index.offsets[index] + 12
+        length = self.index.lengths[index]
+
+        if self._buffer is not None:
+            return self._buffer[offset:offset + length]
+
+        position = self.file.tell()
+        self.file.seek(offset,0)
+        data = self.file.read(length)
+        self.file.seek(position,0)
+        return data
+
+    def read_record_at(self, index, fields=None):
+        """ Read the frame record with the given index, seeking directly to it.
+
+        Unlike read_record(), this does not move the position used by the sequential iterator.
+        fields: Only decode the given fields of the frame, see parse_frame().
+        """
+
+        return parse_frame(self.read_record_buffer(index), fields)
+
+    def records(self, start=0, stop=None, step=1):
+        """ Iterate over the raw serialized frames in range(start, stop, step), see read_record_buffer().
+
+        Each call returns an independent iterator, so several of them can be used concurrently.
+        """
+
+        for index in range(*slice(start, stop, step).indices(len(self))):
+            yield self.read_record_buffer(index)
+
+    def frames(self, start=0, stop=None, step=1, fields=None):
+        """ Iterate over the frames in range(start, stop, step), only reading the records that are needed.
+
+        Each call returns an independent iterator, so several of them can be used concurrently.
+        fields: Only decode the given fields of each frame, see parse_frame().
+        """
+
+        for index in range(*slice(start, stop, step).indices(len(self))):
+            yield self.read_record_at(index, fields)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        """ Random access to frames: reader[i] returns a single frame, reader[a:b:c] a list of frames. """
+
+        if isinstance(key, slice):
+            return list(self.frames(key.start, key.stop, key.step))
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("frame index out of range")
+
+        return self.read_record_at(key)
 
     def __iter__(self):
         """ Simple iterator through the file. Note that the iterator will iterate from the current position, does not support concurrent iterators and will not reset back to the beginning when the end is reached. To reset to the first frame, call reader.seek(0)
+            Use reader.frames() or reader.records() for independent iterators.
         """
         return self
 
@@ -27,6 +27,7 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 # from simple_waymo_open_dataset_reader import dataset_pb2, label_pb2
 from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2, label_pb2
+from tools.waymo_reader.simple_waymo_open_dataset_reader.wire_format import decode_matrix
 
 
 
@@ -191,48 +192,46 @@ def get_image_transform(camera_calibration):
     vehicle_to_image = np.matmul(camera_model, np.matmul(axes_transformation, np.linalg.inv(extrinsic)))
     return vehicle_to_image
 
+def decompress_matrix_float(compressed):
+    """ Decompress and decode a zlib compressed MatrixFloat into a float32 numpy array. """
+
+    # decode from a bytearray so the returned array is writable
+    return decode_matrix(bytearray(zlib.decompress(compressed)), np.float32)
+
+def decompress_matrix_int32(compressed):
+    """ Decompress and decode a zlib compressed MatrixInt32 into an int32 numpy array. """
+
+    return decode_matrix(bytearray(zlib.decompress(compressed)), np.int32)
+
 def parse_range_image_and_camera_projection(laser, second_response=False):
     """ Parse the range image for a given laser.
 
     second_response: If true, return the second strongest response instead of the primary response.
                      The second_response might be useful to detect the edge of objects
+
+    The range image and range image pose are returned as float32, the camera projection as int32.
     """
 
+    ri = None
     range_image_pose = None
     camera_projection = None
 
     if not second_response:
         # Return the strongest response if available
         if len(laser.ri_return1.range_image_compressed) > 0:
-            ri = dataset_pb2.MatrixFloat()
-            ri.ParseFromString(
-                zlib.decompress(laser.ri_return1.range_image_compressed))
-            ri = np.array(ri.data).reshape(ri.shape.dims)
+            ri = decompress_matrix_float(laser.ri_return1.range_image_compressed)
 
             if laser.name == dataset_pb2.LaserName.TOP:
-                range_image_top_pose = dataset_pb2.MatrixFloat()
-                range_image_top_pose.ParseFromString(
-                    zlib.decompress(laser.ri_return1.range_image_pose_compressed))
-                range_image_pose = np.array(range_image_top_pose.data).reshape(range_image_top_pose.shape.dims)
-                
-            camera_projection = dataset_pb2.MatrixInt32()
-            camera_projection.ParseFromString(
-                    zlib.decompress(laser.ri_return1.camera_projection_compressed))
-            camera_projection = np.array(camera_projection.data).reshape(camera_projection.shape.dims)
+                range_image_pose = decompress_matrix_float(laser.ri_return1.range_image_pose_compressed)
+
+            camera_projection = decompress_matrix_int32(laser.ri_return1.camera_projection_compressed)
 
     else:
         # Return the second strongest response if available
 
         if len(laser.ri_return2.range_image_compressed) > 0:
-            ri = dataset_pb2.MatrixFloat()
-            ri.ParseFromString(
-                zlib.decompress(laser.ri_return2.range_image_compressed))
-            ri = np.array(ri.data).reshape(ri.shape.dims)
-                
-            camera_projection = dataset_pb2.MatrixInt32()
-            camera_projection.ParseFromString(
-                    zlib.decompress(laser.ri_return2.camera_projection_compressed))
-            camera_projection = np.array(camera_projection.data).reshape(camera_projection.shape.dims)
+            ri = decompress_matrix_float(laser.ri_return2.range_image_compressed)
+            camera_projection = decompress_matrix_int32(laser.ri_return2.camera_projection_compressed)
 
     return ri, camera_projection, range_image_pose
 
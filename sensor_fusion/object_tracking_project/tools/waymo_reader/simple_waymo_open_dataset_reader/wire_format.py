@@ -0,0 +1,214 @@
+# Copyright (c) 2019, Grégoire Payen de La Garanderie, Durham University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+""" Minimal helpers to walk the protobuf wire format without decoding messages. """
+
+import numpy as np
+
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+def read_varint(data, pos):
+    """ Decode a varint starting at data[pos]. Returns (value, new position). """
+
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+def encode_varint(value):
+    """ Encode a non-negative integer as a varint. """
+
+    out = bytearray()
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+def iter_fields(data, start=0, end=None):
+    """ Iterate over the top-level fields of a serialized message.
+
+    Yields (field_number, wire_type, field_start, value_start, value_end) without copying any data.
+    field_start is the position of the field key, so data[field_start:value_end] is the complete encoded field.
+    For varint fields, value_start..value_end spans the encoded varint; for length-delimited fields it spans
+    the payload only.
+    """
+
+    if end is None:
+        end = len(data)
+
+    pos = start
+    while pos < end:
+        field_start = pos
+        key, pos = read_varint(data, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+
+        if wire_type == WIRETYPE_VARINT:
+            _, value_end = read_varint(data, pos)
+        elif wire_type == WIRETYPE_FIXED64:
+            value_end = pos + 8
+        elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+            length, pos = read_varint(data, pos)
+            value_end = pos + length
+        elif wire_type == WIRETYPE_FIXED32:
+            value_end = pos + 4
+        else:
+            raise ValueError("Unsupported wire type %d for field %d" % (wire_type, field_number))
+
+        yield field_number, wire_type, field_start, pos, value_end
+        pos = value_end
+
+def find_varint_field(data, field_number, start=0, end=None, default=0):
+    """ Return the value of a top-level varint field, or default if it is not present. """
+
+    for number, wire_type, _, value_start, _ in iter_fields(data, start, end):
+        if number == field_number and wire_type == WIRETYPE_VARINT:
+            value, _ = read_varint(data, value_start)
+            return value
+
+    return default
+
+def to_signed64(value):
+    """ Reinterpret an unsigned varint as a two's complement int64. """
+
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def project_message(data, descriptor, fields, start=0, end=None):
+    """ Extract only the requested fields of a serialized message, without decoding the others.
+
+    fields maps field names of the message (given by its protobuf descriptor) to one of:
+      None            keep the complete field.
+      list of values  for repeated sub-messages which have a "name" field (e.g. Frame.lasers or Frame.images),
+                      keep only the entries whose name is in the list; for scalar fields (e.g. Laser.name),
+                      keep the message only if the value is in the list.
+      dict            project each sub-message recursively with this dict.
+
+    Fields which are not listed are skipped as raw byte ranges. Returns the serialized projection as bytes,
+    or None if the message is rejected by one of its scalar filters.
+    """
+
+    chunks = []
+    unseen_filters = {name for name, spec in fields.items()
+                      if isinstance(spec, (list, tuple, set, frozenset))
+                      and descriptor.fields_by_name[name].message_type is None}
+
+    for number, wire_type, field_start, value_start, value_end in iter_fields(data, start, end):
+        field = descriptor.fields_by_number.get(number)
+        if field is None or field.name not in fields:
+            continue
+
+        spec = fields[field.name]
+        if spec is None:
+            chunks.append(data[field_start:value_end])
+
+        elif isinstance(spec, dict):
+            sub_message = project_message(data, field.message_type, spec, value_start, value_end)
+            if sub_message is not None:
+                chunks.append(encode_varint((number << 3) | WIRETYPE_LENGTH_DELIMITED))
+                chunks.append(encode_varint(len(sub_message)))
+                chunks.append(sub_message)
+
+        elif field.message_type is not None:
+            name_field = field.message_type.fields_by_name['name']
+            if find_varint_field(data, name_field.number, value_start, value_end) in spec:
+                chunks.append(data[field_start:value_end])
+
+        else:
+            value, _ = read_varint(data, value_start)
+            if value not in spec:
+                return None
+            unseen_filters.discard(field.name)
+            chunks.append(data[field_start:value_end])
+
+    # absent scalar fields take their default value
+    for name in unseen_filters:
+        if descriptor.fields_by_name[name].default_value not in fields[name]:
+            return None
+
+    return b''.join(chunks)
+
+def decode_packed_fixed32(data, dtype, start=0, end=None):
+    """ View a packed repeated fixed32/float field payload as a numpy array, without copying. """
+
+    return np.frombuffer(data, dtype=dtype, count=((len(data) if end is None else end) - start) // 4, offset=start)
+
+def decode_packed_varint(data, start=0, end=None):
+    """ Decode a packed repeated varint field payload (e.g. int32) into an int64 numpy array.
+
+    All varints are decoded at once with numpy: every byte without continuation bit closes a value, and the
+    7-bit groups of each value are shifted into place and or-ed together.
+    """
+
+    raw = np.frombuffer(data, dtype=np.uint8, count=(len(data) if end is None else end) - start, offset=start)
+    if len(raw) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    last = (raw & 0x80) == 0
+    value_end = np.flatnonzero(last) + 1
+    value_start = np.concatenate(([0], value_end[:-1]))
+
+    # position of each byte within its varint
+    byte_pos = np.arange(len(raw)) - np.repeat(value_start, value_end - value_start)
+    groups = (raw & 0x7f).astype(np.uint64) << (7 * byte_pos).astype(np.uint64)
+
+    # negative int32 values are encoded as ten byte two's complement int64 varints
+    return np.bitwise_or.reduceat(groups, value_start).view(np.int64)
+
+def decode_matrix(data, dtype):
+    """ Decode a serialized MatrixFloat (dtype float32) or MatrixInt32 (dtype int32) message into a numpy array.
+
+    The packed data field is decoded directly from data, so no Python object is created per element.
+    """
+
+    chunks = []
+    dims = []
+    for number, wire_type, _, value_start, value_end in iter_fields(data):
+        if number == 1:
+            if wire_type == WIRETYPE_LENGTH_DELIMITED:
+                if dtype == np.float32:
+                    chunks.append(decode_packed_fixed32(data, '<f4', value_start, value_end))
+                else:
+                    chunks.append(decode_packed_varint(data, value_start, value_end).astype(dtype))
+            elif wire_type == WIRETYPE_FIXED32:
+                chunks.append(decode_packed_fixed32(data, '<f4', value_start, value_end))
+            else:
+                value, _ = read_varint(data, value_start)
+                chunks.append(np.array([to_signed64(value)], dtype=dtype))
+
+        elif number == 2:
+            # MatrixShape: repeated int32 dims = 1, packed or not
+            for _, dims_wire_type, _, dims_start, dims_end in iter_fields(data, value_start, value_end):
+                if dims_wire_type == WIRETYPE_LENGTH_DELIMITED:
+                    dims.extend(decode_packed_varint(data, dims_start, dims_end).tolist())
+                else:
+                    dims.append(to_signed64(read_varint(data, dims_start)[0]))
+
+    if len(chunks) == 1:
+        matrix = chunks[0].astype(dtype, copy=False)
+    else:
+        matrix = np.concatenate(chunks).astype(dtype, copy=False) if chunks else np.zeros(0, dtype=dtype)
+
+    return matrix.reshape(dims)
@@ -0,0 +1,94 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Check the single-pass precision-recall sweep against separate detection runs per threshold
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+## general package imports
+import os
+import sys
+import argparse
+import numpy as np
+
+## Add current working directory and the sensor_fusion directory (sensor_utils) to path
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+
+## Waymo open dataset reader
+from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+from misc.prefetch import prefetch_frames
+
+## 3d object detection
+import student.objdet_pcl as pcl
+import student.objdet_detect as det
+import student.objdet_eval as eval
+
+import misc.objdet_tools as tools
+from sensor_utils.utils import sweep_precision_and_recall
+
+
+## Loads the labels and bev maps of the given frames and validates the labels against the point-clouds
+def load_frames(data_fullpath, frame_ids, configs):
+
+    lidar_name = dataset_pb2.LaserName.TOP
+    fields = {'context': None, 'laser_labels': None, 'lasers': {'name': [lidar_name], 'ri_return1': None}}
+    labels, valid_label_flags, bev_maps = [], [], []
+    for frame, lidar_pcl in prefetch_frames(data_fullpath, frame_ids.start, frame_ids.stop, fields, lidar_name, depth=0, dtype=configs.precision):
+        labels.append(frame.laser_labels)
+        valid_label_flags.append(tools.validate_object_labels(frame.laser_labels, lidar_pcl, configs, 10))
+        bev_maps.append(pcl.bev_from_pcl(lidar_pcl, configs))
+    return labels, valid_label_flags, bev_maps
+
+
+## Records the match tables once at the lowest threshold and compares their sweep against a detection run per threshold
+def sweep_and_verify(args):
+
+    configs = det.load_configs(model_name=args.model_name)
+    model = det.create_model(configs)
+    data_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dataset', args.data_filename)
+    labels, valid_label_flags, bev_maps = load_frames(data_fullpath, range(*args.frames), configs)
+
+    configs.conf_thresh = min(args.conf_thresholds)
+    det_metrics = eval.DetectionMetrics(configs.min_iou)
+    scores, true_positives, num_positives = [], [], 0
+    for frame_bev_maps, frame_labels, frame_valid_label_flags in zip(bev_maps, labels, valid_label_flags):
+        detections, frame_scores = det.detect_objects_array(frame_bev_maps, model, configs, return_scores=True)
+        frame_scores, frame_tp, frame_positives = det_metrics.update(detections, frame_scores, frame_labels, frame_valid_label_flags)
+        scores.append(frame_scores)
+        true_positives.append(frame_tp)
+        num_positives += frame_positives
+    sweep_precisions, sweep_recalls = sweep_precision_and_recall(np.concatenate(scores), np.concatenate(true_positives), num_positives,
+                                                                 args.conf_thresholds, configs.conf_thresh, configs.conf_thresh_inclusive)
+
+    # both have to agree exactly, if the separate runs match their detections in the order of the scores as well; any other
+    # matching, e.g. the default greedy one, may assign labels differently once low-scored detections are removed
+    for conf_thresh, sweep_precision, sweep_recall in zip(args.conf_thresholds, sweep_precisions, sweep_recalls):
+        configs.conf_thresh = conf_thresh
+        pos_negs = []
+        for frame_bev_maps, frame_labels, frame_valid_label_flags in zip(bev_maps, labels, valid_label_flags):
+            detections, frame_scores = det.detect_objects_array(frame_bev_maps, model, configs, return_scores=True)
+            pos_negs.append(eval.measure_detection_performance(detections, frame_labels, frame_valid_label_flags, configs.min_iou, 'score', frame_scores)[2])
+        precision, recall = np.nan_to_num(eval.compute_precision_recall(pos_negs), nan=-1.0) # undefined values are -1 in the sweep
+        print('conf_thresh = {}: sweep precision = {:.4f}, recall = {:.4f}, separate run precision = {:.4f}, recall = {:.4f}'.format(
+              conf_thresh, sweep_precision, sweep_recall, precision, recall))
+        assert np.isclose(sweep_precision, precision, rtol=0, atol=1e-9) and np.isclose(sweep_recall, recall, rtol=0, atol=1e-9), \
+            'Precision-recall sweep deviates from the detection run with conf_thresh = {}'.format(conf_thresh)
+    print('precision-recall sweep is equivalent to separate detection runs')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the precision-recall sweep against separate detection runs per threshold')
+    parser.add_argument('--model_name', default='fpn_resnet', help="options are 'darknet', 'fpn_resnet'")
+    parser.add_argument('--data_filename', default='training_segment-1005081002024129653_5313_150_5333_150_with_camera_labels.tfrecord')
+    parser.add_argument('--frames', type=int, nargs=2, default=[0, 20], help='range of frames to detect objects in')
+    parser.add_argument('--conf_thresholds', type=float, nargs='+', default=[0.3, 0.5, 0.7],
+                        help='the match tables are recorded with the lowest one, the sweep at each one is checked against a separate run')
+    args = parser.parse_args()
+
+    sweep_and_verify(args)
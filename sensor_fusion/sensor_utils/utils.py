@@ -3,7 +3,6 @@ import os
 import sys
 import cv2
 import zlib
-import math
 import numpy as np
 import open3d as o3d
 from PIL import Image
@@ -210,40 +209,14 @@ def range_image_to_point_cloud(frame, lidar_name, visualization=True):
     # Load the calibration data
     calib_lidar = [obj for obj in frame.context.laser_calibrations if obj.name == lidar_name][0]
     
-    # Compute vertical beam inclinations
-    height = ri_range.shape[0]
-    inclination_min = calib_lidar.beam_inclination_min
-    inclination_max = calib_lidar.beam_inclination_max
-    inclinations = np.linspace(inclination_min, inclination_max, height)
-    # Flip the inclinations so that the first angle comes to the top
-    inclinations = np.flip(inclinations)
-
-    # Compute azimuth angle and correct it so that the range image center is aligned to the x-axis
-    width = ri_range.shape[1]
-    extrinsic = np.array(calib_lidar.extrinsic.transform).reshape(4, 4)
-    # atan(y/x)
-    azimuth_correction = math.atan2(extrinsic[1, 0], extrinsic[0, 0])
-    azimuth = np.linspace(np.pi, -np.pi, width) - azimuth_correction
-    
-    # Expand inclination and azimuth such that every range image cell has its own appropriate value pair
-    inclination_tiled = np.broadcast_to(inclinations[:, np.newaxis], (height, width))
-    azimuth_tiled = np.broadcast_to(azimuth[np.newaxis, :], (height, width))
-
-    # Get the 3d coordinates in wrt to lidar frame coordinate
-    x = np.cos(azimuth_tiled) * np.cos(inclination_tiled) * ri_range
-    y = np.sin(azimuth_tiled) * np.cos(inclination_tiled) * ri_range
-    z = np.sin(inclination_tiled) * ri_range
-
-    # Transform the 3D coordinates from lidar coordinate to vehicle coordinate
-    xyz_sensor = np.stack([x, y, z, np.ones_like(z)])
-    # (4, 4) x (4, 64, 2650) -> (4, 64, 2650)
-    xyz_vehicle_coord = np.einsum('ij,jkl->ikl', extrinsic, xyz_sensor)
-    # (4, 64, 2650) -> (64, 2650, 4)
-    xyz_vehicle_coord = xyz_vehicle_coord.transpose(1, 2, 0)
-
-    # Extract points with range > 0
+    # Get the direction of every range image cell in vehicle coordinates, these only depend on the
+    # calibration and are cached by the object detection tools
+    height, width = ri_range.shape
+    directions, translation = tools.get_range_image_directions(calib_lidar, height, width, use_beam_inclinations=False)
+
+    # Extract points with range > 0 and scale their directions with the range
     idx_range = ri_range > 0
-    pcl = xyz_vehicle_coord[idx_range, : 3]
+    pcl = directions[idx_range] * ri_range[idx_range][:, np.newaxis] + translation
 
     # Visualize point-cloud
     if visualization:
@@ -427,11 +400,45 @@ def compute_precision_and_recall(detection_metrices, conf_threshold=0.5):
 
 ################################################################
 
+def sweep_precision_and_recall(scores, true_positives, num_positives, conf_thresholds, record_thresh=0.0, inclusive=True):
+    """
+    Compute the precision and recall for all confidence thresholds from one scored match table,
+    i.e. the scores and true positive flags of all detections and the total number of positives.
+    The table only contains the detections above the threshold it has been recorded with (record_thresh),
+    so precision and recall are undefined for all lower thresholds. With inclusive, detections with a score
+    equal to a threshold are kept (score >= threshold), otherwise they are removed (score > threshold),
+    this has to be the comparison of the detector which recorded the table
+    """
+    # Sort the detections once by descending score, the detections above a threshold are a prefix
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    sorted_scores = np.asarray(scores)[order]
+    cum_tp = np.concatenate(([0], np.cumsum(np.asarray(true_positives)[order])))
+
+    # Number of detections with a score >= threshold (inclusive) or > threshold
+    conf_thresholds = np.asarray(conf_thresholds)
+    num_detections = np.searchsorted(-sorted_scores, -conf_thresholds, side='right' if inclusive else 'left')
+    tp = cum_tp[num_detections]
+    fp = num_detections - tp
+    fn = num_positives - tp
+
+    # Precision and recall are -1 where they are undefined, as in compute_precision_and_recall
+    defined = conf_thresholds >= record_thresh
+    for conf_threshold in conf_thresholds[~defined]:
+        print("No detections recorded for the confidence threshold: {}".format(conf_threshold))
+    precisions = np.divide(tp, tp + fp, out=np.full(len(tp), -1.0), where=defined & ((tp + fp) > 0))
+    recalls = np.divide(tp, tp + fn, out=np.full(len(tp), -1.0), where=defined & ((tp + fn) > 0))
+
+    return precisions, recalls
+
+################################################################
+
 def plot_precision_recall(precisions, recalls):
     """
-    Plot the precision and recall curve
+    Plot the precision and recall curve, thresholds where they are undefined (-1) are left out
     """
-    plt.scatter(recalls, precisions)   
+    precisions, recalls = np.asarray(precisions), np.asarray(recalls)
+    defined = (precisions >= 0) & (recalls >= 0)
+    plt.scatter(recalls[defined], precisions[defined])   
     plt.show()
     
 ################################################################
\ No newline at end of file